@@ -1,11 +1,16 @@
 """htpasswd-based OAuth authentication for local-mcp."""
 
+import asyncio
+import base64
+import hmac
 import html
+import os
+import re
 import secrets
+import threading
 import time
 from pathlib import Path
-from string import Template
-from urllib.parse import urlencode
+from urllib.parse import quote_plus
 
 from fastmcp.server.auth import AccessToken, OAuthProvider
 from mcp.server.auth.provider import (
@@ -23,16 +28,114 @@ from starlette.routing import Route
 
 from local_mcp.settings import HTPASSWD_PATH, SERVER_BASE_URL
 from local_mcp.token_db import (
+    TOKEN_KEY_SEP,
     PendingAuth,
     PermissiveClient,
     StoredAuthCode,
     StoredToken,
     TokenDB,
+    TokenKeyCollision,
 )
 
-LOGIN_TEMPLATE = Template(
-    (Path(__file__).parent / "templates" / "login.html").read_text()
-)
+LOGIN_HTML = (Path(__file__).parent / "templates" / "login.html").read_text()
+
+
+def _split_login_template(template: str) -> tuple[bytes, bytes, bytes]:
+    """Pre-encode the login page around its $error_html/$pending_field holes."""
+    head, _, rest = template.partition("$error_html")
+    middle, _, tail = rest.partition("$pending_field")
+    return head.encode(), middle.encode(), tail.encode()
+
+
+_LOGIN_SEGMENTS = _split_login_template(LOGIN_HTML)
+# The page with both holes empty, served as-is for plain GETs (health checks,
+# scanners)
+_EMPTY_LOGIN_PAGE = b"".join(_LOGIN_SEGMENTS)
+
+# Redirect URI for clients registered without one. AnyUrl is immutable, so
+# one parsed instance can be shared instead of re-validating the string
+_PLACEHOLDER_REDIRECT = AnyUrl("http://localhost/placeholder")
+
+# Everything _generate_token can produce: urlsafe base64 plus TOKEN_KEY_SEP
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_.-]*")
+
+# Parsed htpasswd file, tagged with the (st_mtime_ns, st_size) it was read at
+_HTPASSWD_CACHE: tuple[int, int, HtpasswdFile] | None = None
+_HTPASSWD_LOCK = threading.Lock()
+
+# Recent check_password results: HMAC(username, password) -> (ok, expires_at).
+# Keyed by a keyed digest so plaintext passwords are never kept in memory.
+# Failures get a shorter TTL to bound what a brute-forcer can pin in the cache.
+VERIFY_CACHE_TTL = 300  # 5 minutes
+VERIFY_CACHE_NEGATIVE_TTL = 30
+VERIFY_CACHE_SIZE = 1024
+_VERIFY_CACHE: dict[bytes, tuple[bool, float]] = {}
+_VERIFY_CACHE_KEY = secrets.token_bytes(32)
+
+
+def _load_htpasswd() -> HtpasswdFile | None:
+    """Return the parsed htpasswd file, re-parsing only when it changed on disk."""
+    global _HTPASSWD_CACHE
+    try:
+        st = os.stat(HTPASSWD_PATH)
+    except FileNotFoundError:
+        return None
+    with _HTPASSWD_LOCK:
+        cached = _HTPASSWD_CACHE
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        htpasswd = HtpasswdFile(str(HTPASSWD_PATH))
+        _HTPASSWD_CACHE = (st.st_mtime_ns, st.st_size, htpasswd)
+        _VERIFY_CACHE.clear()  # Results may be stale against the new file
+        return htpasswd
+
+
+def _urlsafe(raw: bytes) -> str:
+    """Unpadded urlsafe base64, as secrets.token_urlsafe produces."""
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _verify_key(username: str, password: str) -> bytes:
+    return hmac.new(
+        _VERIFY_CACHE_KEY, f"{username}\0{password}".encode(), "sha256"
+    ).digest()
+
+
+def _cached_verification(username: str, password: str) -> bool | None:
+    """Recent result for these credentials, or None if they must be checked.
+
+    Only a stat() and a dict lookup, so it is cheap enough for the event loop.
+    """
+    try:
+        st = os.stat(HTPASSWD_PATH)
+    except FileNotFoundError:
+        return False
+    cached = _HTPASSWD_CACHE
+    if not cached or cached[0] != st.st_mtime_ns or cached[1] != st.st_size:
+        return None
+    with _HTPASSWD_LOCK:
+        hit = _VERIFY_CACHE.get(_verify_key(username, password))
+    if hit and hit[1] > time.monotonic():
+        return hit[0]
+    return None
+
+
+def _verify_cached(htpasswd: HtpasswdFile, username: str, password: str) -> bool:
+    """Check a password, reusing recent results to skip the bcrypt round."""
+    key = _verify_key(username, password)
+    now = time.monotonic()
+    with _HTPASSWD_LOCK:
+        hit = _VERIFY_CACHE.get(key)
+    if hit and hit[1] > now:
+        return hit[0]
+
+    ok = htpasswd.check_password(username, password) is True
+    ttl = VERIFY_CACHE_TTL if ok else VERIFY_CACHE_NEGATIVE_TTL
+    with _HTPASSWD_LOCK:
+        if len(_VERIFY_CACHE) >= VERIFY_CACHE_SIZE:
+            _VERIFY_CACHE.pop(next(iter(_VERIFY_CACHE)))  # Evict oldest
+        _VERIFY_CACHE[key] = (ok, now + ttl)
+    return ok
 
 
 class HtpasswdAuth(OAuthProvider):
@@ -46,6 +149,7 @@ class HtpasswdAuth(OAuthProvider):
     REFRESH_TOKEN_LIFETIME = 30 * 24 * 3600  # 30 days
     AUTH_CODE_LIFETIME = 600  # 10 minutes
     PENDING_AUTH_LIFETIME = 600  # 10 minutes
+    SWEEP_INTERVAL = 60  # Seconds between full expiry sweeps of the token DB
 
     def __init__(self, db: TokenDB):
         super().__init__(
@@ -53,47 +157,117 @@ class HtpasswdAuth(OAuthProvider):
             client_registration_options=ClientRegistrationOptions(enabled=True),
         )
         self._db = db
+        self._last_sweep = 0.0
+        # base_url is fixed after init; avoid re-serializing the AnyUrl per request
+        self._login_url_prefix = f"{str(self.base_url).rstrip('/')}/login?pending="
+        # Parse htpasswd up front rather than on the first login; if the
+        # server is ever forked into workers, they inherit the parsed table
+        _load_htpasswd()
 
     # --- Helpers ---
 
+    TOKEN_KEY_BYTES = 6
+    TOKEN_SECRET_BYTES = 32
+    TOKEN_BYTES = TOKEN_KEY_BYTES + TOKEN_SECRET_BYTES
+
+    def _format_token(self, prefix: str, raw: bytes) -> str:
+        """Format TOKEN_BYTES random bytes as ``<prefix><key>.<secret>``.
+
+        The key is what TokenDB indexes on.
+        """
+        key, secret = raw[: self.TOKEN_KEY_BYTES], raw[self.TOKEN_KEY_BYTES :]
+        return f"{prefix}{_urlsafe(key)}{TOKEN_KEY_SEP}{_urlsafe(secret)}"
+
     def _generate_token(self, prefix: str = "") -> str:
-        return f"{prefix}{secrets.token_urlsafe(32)}"
+        return self._format_token(prefix, secrets.token_bytes(self.TOKEN_BYTES))
+
+    def _generate_token_pair(self) -> tuple[str, str]:
+        """Mint (access_token, refresh_token) from a single urandom read."""
+        raw = secrets.token_bytes(2 * self.TOKEN_BYTES)
+        return (
+            self._format_token("at_", raw[: self.TOKEN_BYTES]),
+            self._format_token("rt_", raw[self.TOKEN_BYTES :]),
+        )
+
+    async def _verify_credentials(self, username: str, password: str) -> bool:
+        """Check credentials without blocking the event loop on bcrypt.
+
+        Cache hits are answered inline; misses (htpasswd parse + bcrypt, which
+        releases the GIL) run in the default thread pool.
+        """
+        cached = _cached_verification(username, password)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(
+            self._verify_credentials_sync, username, password
+        )
 
-    def _verify_credentials(self, username: str, password: str) -> bool:
-        if not HTPASSWD_PATH.exists():
+    def _verify_credentials_sync(self, username: str, password: str) -> bool:
+        htpasswd = _load_htpasswd()
+        if htpasswd is None:
             return False
-        htpasswd = HtpasswdFile(str(HTPASSWD_PATH))
-        return htpasswd.check_password(username, password) is True
+        return _verify_cached(htpasswd, username, password)
+
+    def _maybe_sweep(self, now: float) -> None:
+        """Drop long-idle expired entries, at most once per SWEEP_INTERVAL.
+
+        Lookups already evict expired entries lazily; this only keeps entries
+        that are never looked up again from accumulating.
+        """
+        if now - self._last_sweep >= self.SWEEP_INTERVAL:
+            self._last_sweep = now
+            self._db.cleanup_expired(now)
 
     def _create_tokens(
         self, user: str, client_id: str, scopes: list[str]
     ) -> tuple[str, str]:
         """Create and store access + refresh tokens. Returns (access_token, refresh_token)."""
         now = time.time()
-        access_token = self._generate_token("at_")
-        refresh_token = self._generate_token("rt_")
-
-        self._db.set_token(
-            access_token,
-            StoredToken(
-                token=access_token,
-                user=user,
-                scopes=scopes,
-                expires_at=now + self.ACCESS_TOKEN_LIFETIME,
-                client_id=client_id,
-            ),
-        )
-        self._db.set_refresh_token(
-            refresh_token,
-            StoredToken(
-                token=refresh_token,
-                user=user,
-                scopes=scopes,
-                expires_at=now + self.REFRESH_TOKEN_LIFETIME,
-                client_id=client_id,
-            ),
-        )
-        return access_token, refresh_token
+        while True:
+            access_token, refresh_token = self._generate_token_pair()
+            try:
+                self._db.set_token_pair(
+                    access_token,
+                    StoredToken(
+                        access_token, user, scopes, now + self.ACCESS_TOKEN_LIFETIME, client_id
+                    ),
+                    refresh_token,
+                    StoredToken(
+                        refresh_token,
+                        user,
+                        scopes,
+                        now + self.REFRESH_TOKEN_LIFETIME,
+                        client_id,
+                        kind="refresh",
+                    ),
+                )
+            except TokenKeyCollision:
+                continue  # a live token already has one of these keys; mint again
+            return access_token, refresh_token
+
+    def _store_auth_code(self, pending: PendingAuth, user: str) -> str:
+        """Mint and store an auth code for a logged-in pending authorization."""
+        while True:
+            code = self._generate_token("code_")
+            try:
+                self._db.set_auth_code(
+                    code,
+                    StoredAuthCode(
+                        code=code,
+                        client_id=pending.client_id,
+                        redirect_uri=pending.redirect_uri,
+                        scopes=pending.scopes,
+                        code_challenge=pending.code_challenge,
+                        expires_at=time.time() + self.AUTH_CODE_LIFETIME,
+                        user=user,
+                        redirect_uri_provided_explicitly=(
+                            pending.redirect_uri_provided_explicitly
+                        ),
+                    ),
+                )
+            except TokenKeyCollision:
+                continue  # a live code already has this key; mint again
+            return code
 
     def _make_oauth_token(
         self, access_token: str, refresh_token: str, scopes: list[str]
@@ -119,65 +293,62 @@ class HtpasswdAuth(OAuthProvider):
         pending_id = request.query_params.get("pending", "")
 
         if request.method == "GET":
-            return self._login_page(pending_id)
+            return self._login_page(self._clean_pending_id(pending_id))
 
         form = await request.form()
         username = str(form.get("username", ""))
         password = str(form.get("password", ""))
-        pending_id = str(form.get("pending", pending_id))
+        pending_id = self._clean_pending_id(str(form.get("pending", pending_id)))
 
-        if not self._verify_credentials(username, password):
+        if not await self._verify_credentials(username, password):
             return self._login_page(pending_id, "Invalid username or password")
 
         pending = self._db.pop_pending_auth(pending_id) if pending_id else None
         if not pending:
             return HTMLResponse("Session expired. Please try again.", status_code=400)
 
-        code = self._generate_token("code_")
-        self._db.set_auth_code(
-            code,
-            StoredAuthCode(
-                code=code,
-                client_id=pending.client_id,
-                redirect_uri=pending.redirect_uri,
-                scopes=pending.scopes,
-                code_challenge=pending.code_challenge,
-                expires_at=time.time() + self.AUTH_CODE_LIFETIME,
-                user=username,
-                redirect_uri_provided_explicitly=pending.redirect_uri_provided_explicitly,
-            ),
-        )
+        code = self._store_auth_code(pending, username)
 
-        params = {"code": code}
+        # code is URL-safe by construction; only the client's state needs quoting
+        url = f"{pending.redirect_uri}{pending.separator}code={code}"
         if pending.state:
-            params["state"] = pending.state
-        sep = "&" if "?" in pending.redirect_uri else "?"
-        return RedirectResponse(
-            f"{pending.redirect_uri}{sep}{urlencode(params)}", status_code=302
-        )
+            url += f"&state={quote_plus(pending.state)}"
+        return RedirectResponse(url, status_code=302)
+
+    @staticmethod
+    def _clean_pending_id(pending_id: str) -> str:
+        """Drop pending ids we could never have minted.
+
+        Pending ids are echoed back into the login page; anything outside the
+        token alphabet can't match a pending auth anyway, and rejecting it here
+        means the page can interpolate the id without escaping.
+        """
+        return pending_id if _TOKEN_RE.fullmatch(pending_id) else ""
 
     def _login_page(self, pending_id: str, error: str | None = None) -> HTMLResponse:
+        if not error and not pending_id:
+            # Responses are per request (headers, cookies), so only the bytes are shared
+            return HTMLResponse(_EMPTY_LOGIN_PAGE)
         error_html = f'<div class="error">{html.escape(error)}</div>' if error else ""
         pending_field = (
-            f'<input type="hidden" name="pending" value="{html.escape(pending_id)}">'
+            f'<input type="hidden" name="pending" value="{pending_id}">'
             if pending_id
             else ""
         )
+        head, middle, tail = _LOGIN_SEGMENTS
         return HTMLResponse(
-            LOGIN_TEMPLATE.substitute(
-                error_html=error_html, pending_field=pending_field
-            )
+            b"".join((head, error_html.encode(), middle, pending_field.encode(), tail))
         )
 
     # --- OAuth Provider Interface ---
 
     async def get_client(self, client_id: str) -> PermissiveClient | None:
         client = self._db.get_client(client_id)
-        if not client:
+        if client is None:
             client = PermissiveClient(
                 client_id=client_id,
                 client_secret=None,
-                redirect_uris=[AnyUrl("http://localhost/placeholder")],
+                redirect_uris=[_PLACEHOLDER_REDIRECT],
                 token_endpoint_auth_method="client_secret_basic",
             )
             self._db.set_client(client_id, client)
@@ -200,7 +371,7 @@ class HtpasswdAuth(OAuthProvider):
                 client_id=client_id,
                 client_secret=client_secret,
                 redirect_uris=client_info.redirect_uris
-                or [AnyUrl("http://localhost/placeholder")],
+                or [_PLACEHOLDER_REDIRECT],
                 client_name=client_info.client_name,
                 token_endpoint_auth_method=auth_method,
             ),
@@ -223,13 +394,14 @@ class HtpasswdAuth(OAuthProvider):
                 redirect_uri_provided_explicitly=params.redirect_uri_provided_explicitly,
             ),
         )
-        return f"{str(self.base_url).rstrip('/')}/login?pending={pending_id}"
+        return self._login_url_prefix + pending_id
 
     async def load_authorization_code(
         self, client: OAuthClientInformationFull, code: str
     ) -> AuthorizationCode | None:
-        self._db.cleanup_expired()
-        stored = self._db.get_auth_code(code)
+        now = time.time()
+        self._maybe_sweep(now)
+        stored = self._db.get_auth_code(code, now)
         if not stored:
             return None
         return AuthorizationCode(
@@ -254,8 +426,9 @@ class HtpasswdAuth(OAuthProvider):
         return self._make_oauth_token(access, refresh, auth_code.scopes)
 
     async def load_access_token(self, token: str) -> AccessToken | None:
-        self._db.cleanup_expired()
-        stored = self._db.get_token(token)
+        now = time.time()
+        self._maybe_sweep(now)
+        stored = self._db.get_token(token, now)
         if not stored:
             return None
         return AccessToken(
@@ -269,8 +442,9 @@ class HtpasswdAuth(OAuthProvider):
     async def load_refresh_token(
         self, client: OAuthClientInformationFull, token: str
     ) -> RefreshToken | None:
-        self._db.cleanup_expired()
-        stored = self._db.get_refresh_token(token)
+        now = time.time()
+        self._maybe_sweep(now)
+        stored = self._db.get_refresh_token(token, now)
         if not stored:
             return None
         return RefreshToken(
@@ -299,4 +473,3 @@ class HtpasswdAuth(OAuthProvider):
         self, token: str, token_type_hint: str | None = None
     ) -> None:
         self._db.delete_token(token)
-        self._db.delete_refresh_token(token)
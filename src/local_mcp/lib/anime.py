@@ -3,14 +3,23 @@
 Note: Uses fcntl for file locking, which is Unix-only (Linux/macOS).
 """
 
+import asyncio
+import atexit
 import fcntl  # Unix-only
+import fnmatch
+import functools
+import itertools
 import json
 import logging
+import os
 import re
+import threading
+import time
 from contextlib import contextmanager
 from datetime import datetime, timezone
+from operator import itemgetter
 from pathlib import Path
-from typing import Literal, TypedDict
+from typing import BinaryIO, Callable, Iterable, Iterator, Literal, TypedDict
 
 from local_mcp.lib import ratings as ratings_lib
 from local_mcp.lib import torrent
@@ -98,79 +107,332 @@ def ensure_paths():
 # --- Parsing ---
 
 
-def parse_episode(filename: str, path: str = "") -> Episode | None:
-    """Parse episode info from filename into an Episode."""
+def _find_first(s: str, chars: str, start: int) -> int:
+    """Index of the first of chars in s at or after start, or -1."""
+    found = [i for i in (s.find(c, start) for c in chars) if i >= 0]
+    return min(found) if found else -1
+
+
+def _scan_filename(filename: str) -> tuple[str, str, float, str] | None:
+    """Split a filename the way ANIME_NAME_REGEX would, without backtracking.
+
+    One left-to-right pass finds the group, the first quality bracket and its
+    closer; title and episode are then peeled off the text in between from
+    the right. Returns None for anything it can't be sure about (no match,
+    version tags, newlines), so the caller can fall back to the regex.
+    """
+    if not filename.startswith("[") or "\n" in filename:
+        return None
+    group_end = filename.find("]", 1)
+    if group_end < 0:
+        return None
+    quality_start = _find_first(filename, "[(", group_end + 1)
+    if quality_start < 0 or filename.startswith("[v", quality_start):
+        return None
+    quality_end = _find_first(filename, "])", quality_start + 1)
+    if quality_end < 0 or filename.find(".mkv", quality_end + 1) < 0:
+        return None
+
+    # "<title>[ -]*<episode> END", the title being as short as possible
+    middle = filename[group_end + 1 : quality_start].strip()
+    if middle.endswith("END"):
+        middle = middle[:-3].rstrip()
+    episode_end = len(middle)
+    episode_start = episode_end
+    while episode_start and middle[episode_start - 1].isdecimal():
+        episode_start -= 1
+    title_end = episode_start
+    while title_end and (middle[title_end - 1].isspace() or middle[title_end - 1] == "-"):
+        title_end -= 1
+
+    episode = middle[episode_start:episode_end]
+    return (
+        filename[1:group_end],
+        middle[:title_end],
+        float(episode) if episode else -1,
+        filename[quality_start + 1 : quality_end],
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_filename(filename: str) -> tuple[str, str, float, str] | None:
+    """Parse (group, title, episode, quality) from a filename.
+
+    Library files keep their names, so each one is only matched once.
+    """
+    if parsed := _scan_filename(filename):
+        return parsed
     match = ANIME_NAME_REGEX.match(filename)
     if not match:
         return None
 
     groups = match.groupdict()
-    return Episode(
-        group=groups["group"],
-        title=groups["title"],
-        episode=float(groups["episode"]) if groups["episode"] else -1,
-        quality=groups["quality"],
-        path=path,
+    return (
+        groups["group"],
+        groups["title"],
+        float(groups["episode"]) if groups["episode"] else -1,
+        groups["quality"],
     )
 
 
+def parse_episode(filename: str, path: str = "") -> Episode | None:
+    """Parse episode info from filename into an Episode."""
+    parsed = _parse_filename(filename)
+    if parsed is None:
+        return None
+
+    group, title, episode, quality = parsed
+    return Episode(group=group, title=title, episode=episode, quality=quality, path=path)
+
+
 # --- History ---
 
+# orjson is an optional speedup for history (de)serialisation; without it the
+# stdlib json module reads and writes the same JSONL format
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_line(entry: HistoryEntry) -> bytes:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+
+else:
+    _json_loads = json.loads
+
+    def _json_line(entry: HistoryEntry) -> bytes:
+        return (json.dumps(entry) + "\n").encode()
+
+
+def _now_iso() -> str:
+    """Current time as a history timestamp.
+
+    This is the canonical form _history_ts passes through unparsed, so fresh
+    entries never need normalising.
+    """
+    return datetime.now(timezone.utc).isoformat()
+
 
 def _build_history_entry(status: Status, path: Path) -> HistoryEntry:
     """Build a history entry with parsed metadata."""
     entry = HistoryEntry(
-        ts=datetime.now(timezone.utc).isoformat(),
+        ts=_now_iso(),
         status=status,
         path=str(path),
     )
-    if parsed := parse_episode(path.name):
-        entry["series"] = parsed["title"]
-        entry["episode"] = parsed["episode"]
-        entry["group"] = parsed["group"]
-        entry["quality"] = parsed["quality"]
+    # The cached parse, without building an Episode just to copy it
+    if parsed := _parse_filename(path.name):
+        group, title, episode, quality = parsed
+        entry.update(series=title, episode=episode, group=group, quality=quality)
     return entry
 
 
-def _load_history_file() -> list[HistoryEntry]:
-    """Load history entries from JSONL file (internal use)."""
-    if not HISTORY_FILE.exists():
-        return []
+def _basename(path: str) -> str:
+    """Final component of a stored path; cheaper than building a Path."""
+    return path.rpartition("/")[2]
+
+
+# Bytes kept from just before the parsed offset, to spot in-place rewrites
+_HISTORY_TAIL_BYTES = 64
 
+
+def _read_history(
+    start: int = 0, tail: bytes = b"", line_no: int = 0
+) -> tuple[list[HistoryEntry], int, bytes, int] | None:
+    """Parse history entries from byte offset start, one line at a time.
+
+    Returns the entries, the offset parsed up to, the bytes just before it
+    and the number of lines before it. When resuming, tail must match the
+    bytes before start, else the file was rewritten and None is returned, and
+    line_no is the number of lines before start.
+
+    A last line that is malformed and lacks its newline may be an append
+    still being written, so parsing stops at its start and it is read again
+    once it is complete.
+    """
     entries: list[HistoryEntry] = []
-    for i, line in enumerate(HISTORY_FILE.read_text().splitlines(), 1):
-        if not line.strip():
-            continue
-        try:
-            entries.append(json.loads(line))
-        except json.JSONDecodeError:
-            logger.warning(f"Malformed JSON at line {i} in history file")
+    with HISTORY_FILE.open("rb") as f:
+        f.seek(start - len(tail))
+        if f.read(len(tail)) != tail:
+            return None
+        end = start
+        for line in f:
+            if line.strip():
+                try:
+                    entries.append(_json_loads(line))
+                except json.JSONDecodeError:  # orjson's error subclasses this
+                    if not line.endswith(b"\n"):
+                        break
+                    logger.warning(f"Malformed JSON at line {line_no + 1} in history file")
+            end += len(line)
+            line_no += 1
+        f.seek(max(0, end - _HISTORY_TAIL_BYTES))
+        return entries, end, f.read(end - f.tell()), line_no
+
+
+def _history_stamp() -> tuple[str, int, int, int] | None:
+    """Identify the current history file contents by (path, inode, mtime, size)."""
+    try:
+        st = HISTORY_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return str(HISTORY_FILE), st.st_ino, st.st_mtime_ns, st.st_size
+
+
+# Parsed history, tagged with the _history_stamp it was read at and the
+# offset, tail bytes and line number where parsing stopped
+_HISTORY_CACHE: (
+    tuple[tuple[str, int, int, int], list[HistoryEntry], int, bytes, int] | None
+) = None
+
+
+def _load_history_file() -> list[HistoryEntry]:
+    """Load history entries from JSONL file (internal use).
+
+    Unchanged files aren't re-read, and when the file has only been appended
+    to just the new lines are parsed. The returned list is shared with the
+    cache (and grows in place), so callers must not modify it.
+    """
+    global _HISTORY_CACHE
+    stamp = _history_stamp()
+    if stamp is None:
+        return []
+    cached = _HISTORY_CACHE
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    if cached and cached[0][:2] == stamp[:2] and stamp[3] >= cached[2]:
+        # Same file and no shorter: parse just the new lines if it was appended to
+        if (read := _read_history(*cached[2:])) is not None:
+            new_entries, offset, tail, line_no = read
+            cached[1].extend(new_entries)
+            _HISTORY_CACHE = (stamp, cached[1], offset, tail, line_no)
+            return cached[1]
+
+    entries, offset, tail, line_no = _read_history() or ([], 0, b"", 0)
+    _HISTORY_CACHE = (stamp, entries, offset, tail, line_no)
     return entries
 
 
-def _get_disk_files() -> set[Path]:
-    """Get all video files on disk (main + stalled directories)."""
-    main_files = set(BASE_PATH.glob(VIDEO_GLOB))
-    stalled_files = set(STALLED_DIR.glob(VIDEO_GLOB))
-    return main_files | stalled_files
+_is_video_name = re.compile(fnmatch.translate(VIDEO_GLOB)).match
+
+
+def _scan_videos(directory: Path) -> set[Path]:
+    """Video files directly inside directory (non-recursive, like VIDEO_GLOB).
+
+    os.scandir reports each entry's type from the directory listing itself,
+    so only symlinks cost an extra stat.
+    """
+    try:
+        with os.scandir(directory) as it:
+            return {
+                Path(entry.path)
+                for entry in it
+                if _is_video_name(entry.name) and entry.is_file()
+            }
+    except OSError:
+        return set()
+
+
+def _in_stalled_dir(path: Path) -> bool:
+    """True if path is inside STALLED_DIR (string prefix, no parents walk)."""
+    return str(path).startswith(f"{STALLED_DIR}/")
+
+
+def _dir_stamp(directory: Path) -> tuple[str, int, int] | None:
+    """Identify a directory's listing by (path, inode, mtime).
+
+    Adding, removing or renaming an entry updates the directory's mtime.
+    """
+    try:
+        st = directory.stat()
+    except OSError:
+        return None
+    return str(directory), st.st_ino, st.st_mtime_ns
+
+
+# A listing is only reused if both directories were last changed at least
+# this long before it was taken; an entry added within the same mtime tick
+# as the scan could otherwise go unnoticed
+_DISK_SCAN_RACY_NS = 2_000_000_000
+
+# Last disk listing, tagged with the (BASE_PATH, STALLED_DIR) stamps it was
+# taken at; None while those were too recent to trust
+_DISK_CACHE: tuple[tuple, frozenset[Path]] | None = None
+
+
+def _get_disk_files() -> frozenset[Path]:
+    """Get all video files on disk (main + stalled directories).
+
+    Neither directory is re-listed while both are unchanged since the last
+    scan, which is the common case of a library with no new downloads; the
+    very same listing object is then returned.
+    """
+    global _DISK_CACHE
+    stamps = (_dir_stamp(BASE_PATH), _dir_stamp(STALLED_DIR))
+    cached = _DISK_CACHE
+    if cached and cached[0] == stamps:
+        return cached[1]
+
+    scanned_at = time.time_ns()
+    files = frozenset(_scan_videos(BASE_PATH) | _scan_videos(STALLED_DIR))
+    settled = all(
+        stamp is not None and stamp[2] < scanned_at - _DISK_SCAN_RACY_NS
+        for stamp in stamps
+    )
+    _DISK_CACHE = (stamps, files) if settled else None
+    return files
 
 
 HISTORY_LOCK_FILE = HISTORY_FILE.parent / ".anime_history.lock"
 
 
+# The lock file stays open for the life of the process, as (path, fd). flock
+# doesn't exclude threads sharing one descriptor, so a thread lock guards it.
+_LOCK_FD: tuple[Path, int] | None = None
+_LOCK_THREAD = threading.Lock()
+
+
+def _lock_fd() -> int:
+    """Descriptor of HISTORY_LOCK_FILE, reopened if the path or file changed."""
+    global _LOCK_FD
+    if _LOCK_FD is not None:
+        path, fd = _LOCK_FD
+        # A deleted lock file would no longer exclude other processes
+        if path == HISTORY_LOCK_FILE and os.fstat(fd).st_nlink:
+            return fd
+        os.close(fd)
+        _LOCK_FD = None
+    HISTORY_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(HISTORY_LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o644)
+    _LOCK_FD = (HISTORY_LOCK_FILE, fd)
+    return fd
+
+
+@atexit.register
+def _close_lock_fd() -> None:
+    global _LOCK_FD
+    if _LOCK_FD is not None:
+        os.close(_LOCK_FD[1])
+        _LOCK_FD = None
+
+
 @contextmanager
 def _history_lock():
     """Acquire exclusive lock on history file to prevent race conditions."""
-    HISTORY_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(HISTORY_LOCK_FILE, "w") as lock_file:
-        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    with _LOCK_THREAD:
+        fd = _lock_fd()
+        fcntl.flock(fd, fcntl.LOCK_EX)
         try:
             yield
         finally:
-            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            fcntl.flock(fd, fcntl.LOCK_UN)
 
 
-def sync_history(disk_files: set[Path]) -> list[HistoryEntry]:
+def sync_history(disk_files: Iterable[Path]) -> list[HistoryEntry]:
     """
     Sync history with disk state.
 
@@ -184,131 +446,262 @@ def sync_history(disk_files: set[Path]) -> list[HistoryEntry]:
         entries = _load_history_file()
 
         # Get known paths from history
-        known_paths = {Path(e["path"]).name for e in entries if "path" in e}
-
-        # Check disk for files not in history
-        for path in disk_files:
-            if path.name not in known_paths:
-                # Files in stalled dir start as "stalled", others as "unwatched"
-                initial_status: Status = (
-                    "stalled" if STALLED_DIR in path.parents else "unwatched"
-                )
-                entry = _build_history_entry(initial_status, path)
-                entries.append(entry)
-                _write_history_entry_unlocked(entry)
+        known_paths = {_basename(e["path"]) for e in entries if "path" in e}
 
-    return entries
+        # Disk files not in history, found with one set difference
+        disk_by_name = {path.name: path for path in disk_files}
+        new_entries: list[HistoryEntry] = []
+        for name in disk_by_name.keys() - known_paths:
+            path = disk_by_name[name]
+            # Files in stalled dir start as "stalled", others as "unwatched"
+            initial_status: Status = "stalled" if _in_stalled_dir(path) else "unwatched"
+            new_entries.append(_build_history_entry(initial_status, path))
+        if new_entries:
+            _write_history_entries_unlocked(new_entries)
+
+        return _load_history_file()
+
+
+# Compact the history once it has this many entries, and this many times more
+# entries than files it still describes
+HISTORY_COMPACT_MIN_ENTRIES = 1000
+HISTORY_COMPACT_RATIO = 4
+
+
+def _write_synced(f: BinaryIO, data: bytes) -> None:
+    """Write data and flush it to disk, once for the whole batch."""
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _compact_entries(entries: list[HistoryEntry]) -> list[HistoryEntry]:
+    """The entries that still affect any history view, in their original order.
+
+    That is the last entry for each file (whose status the views use), the
+    newest one by timestamp for each file if that is another (entries need not
+    have been appended in time order), the entry with each series' highest
+    watched episode, and any entries without a path.
+    """
+    keep: set[int] = set()
+    latest: dict[str, int] = {}
+    newest: dict[str, tuple[str, int]] = {}
+    best_watched: dict[str, tuple[float, int]] = {}
+    for i, entry in enumerate(entries):
+        if "path" in entry:
+            name = _basename(entry["path"])
+            latest[name] = i
+            ts = _history_ts(entry.get("ts"))
+            if ts and (name not in newest or ts >= newest[name][0]):
+                newest[name] = (ts, i)
+        else:
+            keep.add(i)
+        series = entry.get("series")
+        if entry.get("status") == "watched" and series is not None and "episode" in entry:
+            best = best_watched.get(series)
+            if best is None or entry["episode"] > best[0]:
+                best_watched[series] = (entry["episode"], i)
+    keep.update(latest.values())
+    keep.update(i for _, i in newest.values())
+    keep.update(i for _, i in best_watched.values())
+    return [entries[i] for i in sorted(keep)]
+
+
+def _compact_history_unlocked(entries: list[HistoryEntry]) -> list[HistoryEntry]:
+    """Atomically rewrite history down to _compact_entries (caller must hold lock).
+
+    Bounds load time by the number of files rather than every event ever
+    recorded. Returns the entries now on disk.
+    """
+    global _HISTORY_CACHE
+    compacted = _compact_entries(entries)
+    data = b"".join(_json_line(entry) for entry in compacted)
+    tmp = HISTORY_FILE.with_name(HISTORY_FILE.name + ".tmp")
+    with open(tmp, "wb") as f:
+        _write_synced(f, data)
+    os.replace(tmp, HISTORY_FILE)
+    if stamp := _history_stamp():
+        _HISTORY_CACHE = (
+            stamp, compacted, len(data), data[-_HISTORY_TAIL_BYTES:], len(compacted)
+        )
+    logger.info(f"Compacted history from {len(entries)} to {len(compacted)} entries")
+    return compacted
+
+
+def _write_history_entries_unlocked(entries: list[HistoryEntry]) -> None:
+    """Append entries to history file in one write (caller must hold lock).
+
+    The next load picks them up by parsing just the appended lines.
+    """
+    with open(HISTORY_FILE, "ab") as f:
+        _write_synced(f, b"".join(_json_line(entry) for entry in entries))
 
 
-def _write_history_entry_unlocked(entry: HistoryEntry) -> None:
-    """Append entry to history file (caller must hold lock)."""
-    with open(HISTORY_FILE, "a") as f:
-        f.write(json.dumps(entry) + "\n")
+def _maybe_compact_history_unlocked() -> None:
+    """Compact history once most entries are superseded (caller must hold lock)."""
+    entries = _load_history_file()
+    if len(entries) >= HISTORY_COMPACT_MIN_ENTRIES and len(entries) > (
+        HISTORY_COMPACT_RATIO * len(_history_views(entries)[0])
+    ):
+        _compact_history_unlocked(entries)
 
 
 def write_history_entry(entry: HistoryEntry) -> None:
-    """Append a single entry to history file (thread-safe)."""
+    """Append a single entry to history file (thread-safe).
+
+    This is also where the history gets compacted, so that only an explicit
+    write ever rewrites the file, never a read such as get_library.
+    """
     with _history_lock():
-        _write_history_entry_unlocked(entry)
+        _write_history_entries_unlocked([entry])
+        _maybe_compact_history_unlocked()
 
 
-def _latest_status_by_filename(history: list[HistoryEntry]) -> dict[str, Status]:
-    """Get the latest status for each filename from history.
+# Latest status per filename, highest watched episode per series, and most
+# recent activity per series (as a canonical UTC ISO string, see _utc_iso)
+HistoryViews = tuple[dict[str, Status], dict[str, float], dict[str, str]]
+
+# Views of the last history list seen, with the length they were built at
+_VIEWS_CACHE: tuple[list[HistoryEntry], int, HistoryViews] | None = None
 
-    Returns a dict mapping filename -> status, using the most recent entry
-    for each file (latest entry wins).
-    """
-    result: dict[str, Status] = {}
-    for entry in history:
-        if "path" in entry and "status" in entry:
-            filename = Path(entry["path"]).name
-            # Later entries overwrite earlier ones (latest wins)
-            result[filename] = entry["status"]
-    return result
 
+def _history_views(history: list[HistoryEntry]) -> HistoryViews:
+    """Derive the per-file and per-series views of history in a single pass.
 
-def _watched_episodes_by_series(history: list[HistoryEntry]) -> dict[str, float]:
-    """Get highest watched episode number for each series from history."""
-    series_max: dict[str, float] = {}
-    for entry in history:
-        if (
-            entry.get("status") == "watched"
-            and "series" in entry
-            and "episode" in entry
-        ):
-            series = entry["series"]
+    For each filename the latest entry wins. The (cached) history list only
+    ever grows in place, so when it has, only the new entries are applied on
+    top of the previous views.
+    """
+    global _VIEWS_CACHE
+    cached = _VIEWS_CACHE
+    if cached and cached[0] is history and cached[1] <= len(history):
+        start, views = cached[1], cached[2]
+    else:
+        start, views = 0, ({}, {}, {})
+
+    status_by_filename, series_max, series_ts = views
+    for entry in itertools.islice(history, start, None):
+        status = entry.get("status")
+        series = entry.get("series")
+        if status and "path" in entry:
+            # Later entries overwrite earlier ones (latest wins)
+            status_by_filename[_basename(entry["path"])] = status
+        if status == "watched" and series is not None and "episode" in entry:
             episode = entry["episode"]
             if series not in series_max or episode > series_max[series]:
                 series_max[series] = episode
-    return series_max
+        if series and (ts := _history_ts(entry.get("ts"))):
+            if series not in series_ts or ts > series_ts[series]:
+                series_ts[series] = ts
+
+    _VIEWS_CACHE = (history, len(history), views)
+    return views
 
 
 # --- Library ---
 
 
-def _episode_status(path: Path, status_by_filename: dict[str, Status]) -> Status:
-    """Determine episode status: 'watched', 'stalled', 'manual', or 'unwatched'.
+def build_library() -> dict[str, Series]:
+    """Build library state from disk entries, grouped by series.
 
-    Priority: history status > stalled directory > unwatched default.
-    Uses latest history entry for each file (latest wins).
+    The library itself is cached, so callers get copies they may modify.
     """
-    # Check history first (latest entry wins)
-    if path.name in status_by_filename:
-        return status_by_filename[path.name]
-    # Files in stalled directory without explicit history status
-    if STALLED_DIR in path.parents:
-        return "stalled"
-    return "unwatched"
+    return {
+        title: _copy_series(s) for title, s in _build_library_with_history()[0].items()
+    }
 
 
-def build_library() -> dict[str, Series]:
-    """Build library state from disk entries, grouped by series."""
+def _copy_series(s: Series) -> Series:
+    """Copy of a cached series, down to its episodes."""
+    return {**s, "episodes": [{**e} for e in s["episodes"]]}
+
+
+# Series title -> the statuses of its episodes
+SeriesStatuses = dict[str, set[Status]]
+
+
+LibraryState = tuple[dict[str, Series], HistoryViews, SeriesStatuses]
+
+# The last library built, with the disk listing and history list (and its
+# length) it was built from
+_LIBRARY_CACHE: (
+    tuple[frozenset[Path], list[HistoryEntry], int, LibraryState] | None
+) = None
+
+
+def _build_library_with_history() -> LibraryState:
+    """Build the library, also returning the history views it was built from.
+
+    The third element maps each series title to the set of its episodes'
+    statuses, gathered while grouping so status filters need not rescan.
+
+    The disk listing and the history list are both reused while unchanged,
+    so when neither is new (nor the history longer) the last library is
+    returned as is.
+    """
+    global _LIBRARY_CACHE
     disk_files = _get_disk_files()
     history = sync_history(disk_files)
-    status_by_filename = _latest_status_by_filename(history)
-    history_watched = _watched_episodes_by_series(history)
-
-    # Parse disk entries with status
-    entries = []
-    for path in sorted(disk_files):
-        if ep := parse_episode(path.name, path=str(path)):
-            ep["status"] = _episode_status(path, status_by_filename)
-            entries.append(ep)
+    cached = _LIBRARY_CACHE
+    if (
+        cached
+        and cached[0] is disk_files
+        and cached[1] is history
+        and cached[2] == len(history)
+    ):
+        return cached[3]
+
+    views = _history_views(history)
+    status_by_filename, history_watched, _ = views
 
     series_map: dict[str, dict] = {}
+    series_statuses: SeriesStatuses = {}
+
+    # Parse disk entries with status, grouping them by series as we go.
+    # A series takes its group/quality from its first file, so keep a stable
+    # order; comparing the (cached) path strings is ~10x cheaper than Path.__lt__
+    for path in sorted(disk_files, key=str):
+        name = path.name
+        ep = parse_episode(name)
+        if ep is None:
+            continue
+        # sync_history has recorded every disk file, so the latest history
+        # entry normally decides; the directory only matters for files
+        # whose entries lack a status
+        status = status_by_filename.get(name)
+        if status is None:
+            status = "stalled" if _in_stalled_dir(path) else "unwatched"
 
-    for ep in entries:
         title = ep["title"]
-        if title not in series_map:
-            series_map[title] = {
+        episode = ep["episode"]
+        series = series_map.get(title)
+        if series is None:
+            series = series_map[title] = {
                 "title": title,
                 "group": ep["group"],
                 "quality": ep["quality"],
                 "episodes": [],
+                "latest_episode": episode,
+                "latest_watched": 0,
             }
-
-        series_map[title]["episodes"].append(
-            {
-                "episode": ep["episode"],
-                "path": ep["path"],
-                "status": ep["status"],
-            }
-        )
-
-    # Sort episodes and compute aggregates
-    for series in series_map.values():
-        series["episodes"].sort(key=lambda e: e["episode"])
-        series["latest_episode"] = max(e["episode"] for e in series["episodes"])
+            series_statuses[title] = set()
+        series["episodes"].append({"episode": episode, "path": str(path), "status": status})
+        series_statuses[title].add(status)
+        # Maxima are kept up to date as episodes are added
+        if episode > series["latest_episode"]:
+            series["latest_episode"] = episode
+        if status == "watched" and episode > series["latest_watched"]:
+            series["latest_watched"] = episode
+
+    for title, series in series_map.items():
+        series["episodes"].sort(key=itemgetter("episode"))
         # Include history so deleted-but-watched episodes are counted
-        series["latest_watched"] = max(
-            max(
-                (e["episode"] for e in series["episodes"] if e["status"] == "watched"),
-                default=0,
-            ),
-            history_watched.get(series["title"], 0),
-        )
+        if (watched := history_watched.get(title, 0)) > series["latest_watched"]:
+            series["latest_watched"] = watched
 
-    return series_map
+    state = (series_map, views, series_statuses)
+    _LIBRARY_CACHE = (disk_files, history, len(history), state)
+    return state
 
 
 async def check_trusted_releases(download: bool = False) -> dict:
@@ -321,70 +714,91 @@ async def check_trusted_releases(download: bool = False) -> dict:
     This is more efficient than per-series searching - only a few requests
     regardless of library size.
     """
-    library = build_library()
-    tracked_series = {s["title"]: s for s in library.values()}
+    library = _build_library_with_history()[0]  # only read, so no copies
+    # Episodes at or below these are already on disk or watched
+    seen_up_to = {
+        title: max(s["latest_episode"], s["latest_watched"])
+        for title, s in library.items()
+    }
 
     # Fetch and merge releases from trusted groups (priority order)
-    # series -> episode -> info (first group wins)
+    # series -> new episode -> info (first group wins)
     all_releases: dict[str, dict[float, dict]] = {}
 
-    for group in TRUSTED_GROUPS:
-        print(f"Fetching releases from {group}...")
-        try:
-            releases = await torrent.fetch_group_releases(group)
+    print(f"Fetching releases from {len(TRUSTED_GROUPS)} groups...")
+    # One connection pool serves every listing and torrent download
+    async with torrent.nyaa_client() as client:
+        # Fetch concurrently; merging below still goes in priority order
+        results = await asyncio.gather(
+            *(
+                torrent.fetch_group_releases(group, client=client)
+                for group in TRUSTED_GROUPS
+            ),
+            return_exceptions=True,
+        )
+
+        for group, releases in zip(TRUSTED_GROUPS, results):
+            if isinstance(releases, BaseException):
+                print(f"  Error fetching {group}: {releases}")
+                continue
             for ep in releases:
                 series = ep["title"]
                 episode = ep["episode"]
 
                 # Only track if series is in library
-                if series not in tracked_series:
+                if series not in seen_up_to:
                     continue
 
-                # Priority: first group wins
-                if series not in all_releases:
-                    all_releases[series] = {}
-                if episode not in all_releases[series]:
-                    all_releases[series][episode] = ep
-        except Exception as e:
-            print(f"  Error fetching {group}: {e}")
+                # Keep new episodes only; priority: first group wins
+                episodes = all_releases.setdefault(series, {})
+                if episode > seen_up_to[series]:
+                    episodes.setdefault(episode, ep)
+
+        # Find new episodes
+        available = []
+        to_download = []
+
+        for series, episodes in sorted(all_releases.items()):
+            for episode_num, ep in sorted(episodes.items()):
+                entry = {
+                    "series": series,
+                    "episode": episode_num,
+                    "torrent": ep.get("torrent"),
+                    "group": ep["group"],
+                    "quality": ep["quality"],
+                }
+                available.append(entry)
+                if download and ep.get("torrent"):
+                    to_download.append(entry)
+
+        # Download concurrently, without blocking the event loop
+        dests = await asyncio.gather(
+            *(torrent.download_async(e["torrent"], client=client) for e in to_download),
+            return_exceptions=True,
+        )
 
-    # Find new episodes
-    available = []
     downloaded = []
-
-    for series, episodes in sorted(all_releases.items()):
-        lib_series = tracked_series[series]
-        after_episode = max(lib_series["latest_episode"], lib_series["latest_watched"])
-
-        for episode_num, ep in sorted(episodes.items()):
-            if episode_num <= after_episode:
-                continue
-
-            entry = {
-                "series": series,
-                "episode": episode_num,
-                "torrent": ep.get("torrent"),
-                "group": ep["group"],
-                "quality": ep["quality"],
-            }
-            available.append(entry)
-
-            if download and ep.get("torrent"):
-                dest = torrent.download(ep["torrent"])
-                video_path = torrent.video_path(dest)
-                if video_path:
-                    write_history_entry(
-                        HistoryEntry(
-                            ts=datetime.now(timezone.utc).isoformat(),
-                            status="unwatched",
-                            path=video_path,
-                            series=series,
-                            episode=episode_num,
-                            group=ep["group"],
-                            quality=ep["quality"],
-                        )
-                    )
-                downloaded.append({**entry, "downloaded_to": str(dest)})
+    new_entries: list[HistoryEntry] = []
+    for entry, dest in zip(to_download, dests):
+        if isinstance(dest, BaseException):
+            print(f"  Error downloading {entry['torrent']}: {dest}")
+            continue
+        if video_path := torrent.video_path(dest):
+            new_entries.append(
+                HistoryEntry(
+                    ts=_now_iso(),
+                    status="unwatched",
+                    path=video_path,
+                    series=entry["series"],
+                    episode=entry["episode"],
+                    group=entry["group"],
+                    quality=entry["quality"],
+                )
+            )
+        downloaded.append({**entry, "downloaded_to": str(dest)})
+    if new_entries:
+        with _history_lock():
+            _write_history_entries_unlocked(new_entries)
 
     return {
         "available": available,
@@ -394,26 +808,32 @@ async def check_trusted_releases(download: bool = False) -> dict:
     }
 
 
-def _fuzzy_match(query: str, target: str) -> bool:
-    """Basic fuzzy matching: case-insensitive substring or word matching.
+def _fuzzy_matcher(query: str) -> Callable[[str], bool]:
+    """Build a case-insensitive fuzzy matcher for query.
 
-    Matches if:
+    The returned function matches a target if:
     - query is a substring of target (case-insensitive)
     - all words in query appear in target (case-insensitive)
+
+    The query is lowered and split once, so matching it against many targets
+    only costs one lower() per target.
     """
     query_lower = query.lower()
-    target_lower = target.lower()
+    query_words = query_lower.split()
 
-    # Direct substring match
-    if query_lower in target_lower:
-        return True
+    def match(target: str) -> bool:
+        target_lower = target.lower()
+        # Direct substring match, else all query words appear in target
+        return query_lower in target_lower or all(
+            word in target_lower for word in query_words
+        )
+
+    return match
 
-    # All query words appear in target
-    query_words = query_lower.split()
-    if all(word in target_lower for word in query_words):
-        return True
 
-    return False
+def _fuzzy_match(query: str, target: str) -> bool:
+    """Basic fuzzy matching: case-insensitive substring or word matching."""
+    return _fuzzy_matcher(query)(target)
 
 
 def _parse_timestamp(ts_str: str | None) -> datetime | None:
@@ -429,36 +849,57 @@ def _parse_timestamp(ts_str: str | None) -> datetime | None:
         return None
 
 
-def _get_series_timestamps(history: list[HistoryEntry]) -> dict[str, datetime]:
-    """Get the most recent timestamp for each series from history."""
-    series_ts: dict[str, datetime] = {}
-    for entry in history:
-        series = entry.get("series")
-        ts = _parse_timestamp(entry.get("ts"))
-        if series and ts:
-            if series not in series_ts or ts > series_ts[series]:
-                series_ts[series] = ts
-    return series_ts
+def _utc_iso(ts_str: str | None) -> str | None:
+    """Normalise an ISO timestamp to UTC isoformat(), returns None on failure.
+
+    Canonical strings sort chronologically, so they can be compared without
+    building datetimes. Naive timestamps are taken to be UTC.
+    """
+    ts = _parse_timestamp(ts_str)
+    if ts is None:
+        return None
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc).isoformat()
+    return ts.astimezone(timezone.utc).isoformat()
+
 
+def _history_ts(ts_str: str | None) -> str | None:
+    """_utc_iso for history timestamps.
 
-def _attach_ratings(series_list: list[dict]) -> list[dict]:
-    """Attach latest rating entry to each series (exact, then unique fuzzy)."""
+    _now_iso writes these in the canonical form already, so UTC ones are
+    returned as-is. Caller-supplied times (which may use a space separator
+    or omit seconds) must go through _utc_iso.
+    """
+    if ts_str and ts_str.endswith("+00:00"):
+        return ts_str
+    return _utc_iso(ts_str)
+
+
+def _attach_ratings(series_list: list[Series]) -> list[dict]:
+    """Copies of each series with its latest rating entry (exact, then unique fuzzy).
+
+    The library itself may be cached, so the series and their episodes are
+    copied rather than modified or handed out.
+    """
     latest = ratings_lib.latest_ratings()
+    result = []
     for s in series_list:
         entry = latest.get(s["title"])
         if entry is None:
+            matches_title = _fuzzy_matcher(s["title"])
             fuzzy = [
                 r
                 for title, r in latest.items()
-                if _fuzzy_match(s["title"], title) or _fuzzy_match(title, s["title"])
+                if matches_title(title) or _fuzzy_match(title, s["title"])
             ]
             entry = fuzzy[0] if len(fuzzy) == 1 else None
-        s["rating"] = (
+        rating = (
             {"rating": entry.get("rating"), "status": entry.get("status"), "ts": entry.get("ts")}
             if entry
             else None
         )
-    return series_list
+        result.append({**_copy_series(s), "rating": rating})
+    return result
 
 
 def get_library(
@@ -483,67 +924,57 @@ def get_library(
         min_episode: Only series with episodes >= this number
         max_episode: Only series with episodes <= this number
     """
-    library = build_library()
-
-    # Get history for timestamp filtering
-    history = _load_history_file() if (since or before) else []
-    series_timestamps = _get_series_timestamps(history) if history else {}
+    # The history views come from the same load, for timestamp filtering
+    library, (_, _, series_timestamps), series_statuses = (
+        _build_library_with_history()
+    )
 
     # Parse timestamp filters
-    since_dt = _parse_timestamp(since)
-    before_dt = _parse_timestamp(before)
+    since_iso = _utc_iso(since)
+    before_iso = _utc_iso(before)
 
     if series:
         if series in library:
             return {"series": _attach_ratings([library[series]])}
         return {"series": [], "error": f"Series '{series}' not found"}
 
-    result = list(library.values())
-
-    # Fuzzy search by title
-    if search:
-        result = [s for s in result if _fuzzy_match(search, s["title"])]
-
-    # Filter by release group
-    if group:
-        group_lower = group.lower()
-        result = [s for s in result if group_lower in s["group"].lower()]
-
-    # Filter by timestamp - series with recent activity
-    if since_dt:
-        result = [
-            s
-            for s in result
-            if s["title"] in series_timestamps and series_timestamps[s["title"]] >= since_dt
-        ]
-    if before_dt:
-        result = [
-            s
-            for s in result
-            if s["title"] in series_timestamps and series_timestamps[s["title"]] <= before_dt
-        ]
-
-    # Filter by episode range
-    if min_episode is not None:
-        result = [s for s in result if s["latest_episode"] >= min_episode]
-    if max_episode is not None:
-        result = [
-            s for s in result if any(e["episode"] <= max_episode for e in s["episodes"])
-        ]
-
-    # Filter by status if requested
-    if status == "watched":
-        # Special case: series where ALL episodes are watched
-        result = [
-            s for s in result if all(e["status"] == "watched" for e in s["episodes"])
-        ]
-    elif status:
-        # For unwatched/stalled/manual: series with at least one episode of that status
-        result = [
-            s for s in result if any(e["status"] == status for e in s["episodes"])
-        ]
-
-    return {"series": _attach_ratings(sorted(result, key=lambda s: s["title"]))}
+    matches_search = _fuzzy_matcher(search) if search else None
+    group_lower = group.lower() if group else None
+
+    # Every requested filter is applied in a single pass over the library
+    def matches(s: Series) -> bool:
+        # Fuzzy search by title
+        if matches_search and not matches_search(s["title"]):
+            return False
+        # Filter by release group
+        if group_lower and group_lower not in s["group"].lower():
+            return False
+
+        # Filter by timestamp - series with recent activity
+        # Series without activity have no timestamp and match neither filter;
+        # "" sorts before every ISO string
+        if since_iso and series_timestamps.get(s["title"], "") < since_iso:
+            return False
+        if before_iso and not "" < series_timestamps.get(s["title"], "") <= before_iso:
+            return False
+
+        # Filter by episode range (episodes are sorted by number)
+        if min_episode is not None and s["latest_episode"] < min_episode:
+            return False
+        if max_episode is not None and s["episodes"][0]["episode"] > max_episode:
+            return False
+
+        # Filter by status if requested
+        if status == "watched":
+            # Special case: series where ALL episodes are watched
+            return series_statuses[s["title"]] == {"watched"}
+        if status:
+            # For unwatched/stalled/manual: series with at least one episode of that status
+            return status in series_statuses[s["title"]]
+        return True
+
+    result = sorted(filter(matches, library.values()), key=itemgetter("title"))
+    return {"series": _attach_ratings(result)}
 
 
 def path_outside_anime_dirs(episode_path: Path) -> bool:
@@ -588,7 +1019,7 @@ def mark_episode(path: str, status: Literal["watched", "stalled", "manual"]) ->
 
     if status == "stalled":
         # Already in stalled dir? Just record in history, don't move
-        if STALLED_DIR in episode_path.parents or episode_path.parent == STALLED_DIR:
+        if _in_stalled_dir(episode_path):
             write_history_entry(_build_history_entry("stalled", episode_path))
             return {"status": "stalled", "path": str(episode_path)}
         dest = STALLED_DIR / episode_path.name
@@ -615,6 +1046,4 @@ async def check_and_download():
 
 def main():
     """Sync CLI entry point for cron."""
-    import asyncio
-
     asyncio.run(check_and_download())
@@ -1,11 +1,12 @@
 """Music/MPD control - core implementation using direct MPD protocol."""
 
 import asyncio
+import functools
 import random
 import re
 import time
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import AsyncIterator, Callable
 
 from local_mcp.settings import (
     CACHE_TIMEOUT,
@@ -21,100 +22,242 @@ class MPDError(Exception):
     pass
 
 
+# Idle MPD connections are kept open between calls, saving the TCP connect and
+# greeting per call. Each call borrows a connection of its own, so a slow one
+# (e.g. a library walk) holds up no other. Streams belong to the event loop
+# they were made on, so a new loop starts a new pool.
+_POOL: tuple[
+    asyncio.AbstractEventLoop,
+    list[tuple[asyncio.StreamReader, asyncio.StreamWriter, float]],
+] | None = None
+# Idle connections kept at most; more are closed when they are given back
+_POOL_SIZE = 2
+# MPD drops clients idle for its connection_timeout (60s by default), so a
+# connection idle for longer than this is replaced rather than reused
+_POOL_MAX_IDLE = 30.0
+# MPD may have gone away (e.g. reset the connection) without that having been
+# seen yet, so a connection idle for longer than this is pinged before reuse
+_POOL_PING_AFTER = 0.5
+# Seconds to wait for MPD to send anything before giving up on a response
+_READ_TIMEOUT = 10.0
+
+
+async def _open_connection() -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Connect to MPD and read its greeting (OK MPD x.x.x)."""
+    reader, writer = await asyncio.open_connection(MPD_HOST, MPD_PORT)
+    try:
+        greeting = await asyncio.wait_for(reader.readline(), _READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        writer.close()
+        raise MPDError("Timed out waiting for the MPD greeting") from None
+    if not greeting.startswith(b"OK MPD"):
+        writer.close()
+        raise MPDError(
+            f"Unexpected greeting: {greeting.decode('utf-8', errors='replace')}"
+        )
+    return reader, writer
+
+
+async def _reusable(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, last_used: float
+) -> bool:
+    """Whether a pooled connection can be lent out again."""
+    if reader.at_eof() or writer.is_closing():
+        return False
+    idle = time.monotonic() - last_used
+    if idle > _POOL_MAX_IDLE:
+        return False
+    if idle > _POOL_PING_AFTER:
+        try:
+            await mpd_command(reader, writer, "ping")
+        except MPDError:
+            return False
+    return True
+
+
+def _idle_connections() -> list[
+    tuple[asyncio.StreamReader, asyncio.StreamWriter, float]
+]:
+    """The pooled idle connections (reader, writer, last used) of the running loop."""
+    global _POOL
+    loop = asyncio.get_running_loop()
+    if _POOL is None or _POOL[0] is not loop:
+        _POOL = (loop, [])
+    return _POOL[1]
+
+
 @asynccontextmanager
 async def mpd_connection() -> AsyncIterator[
     tuple[asyncio.StreamReader, asyncio.StreamWriter]
 ]:
-    """Context manager for MPD connection."""
-    reader, writer = await asyncio.open_connection(MPD_HOST, MPD_PORT)
+    """Context manager lending out a pooled MPD connection.
+
+    Pooled connections that MPD closed, may have timed out or that do not
+    answer a ping are closed, and a new one is opened if none is left. The
+    connection is dropped if the body raises, as a response may have been
+    left half read.
+    """
+    idle = _idle_connections()
+    while idle:
+        reader, writer, last_used = idle.pop()
+        if await _reusable(reader, writer, last_used):
+            break
+        writer.close()
+    else:
+        reader, writer = await _open_connection()
     try:
-        # Read greeting (OK MPD x.x.x)
-        greeting = await reader.readline()
-        if not greeting.startswith(b"OK MPD"):
-            raise MPDError(
-                f"Unexpected greeting: {greeting.decode('utf-8', errors='replace')}"
-            )
         yield reader, writer
-    finally:
+    except BaseException:
+        writer.close()
+        raise
+    if len(idle) < _POOL_SIZE:
+        idle.append((reader, writer, time.monotonic()))
+    else:
+        writer.close()
+
+
+async def close_connections() -> None:
+    """Close the pooled idle connections, e.g. when the server shuts down."""
+    global _POOL
+    pool, _POOL = _POOL, None
+    if pool is None or pool[0] is not asyncio.get_running_loop():
+        return  # streams of another loop cannot be closed from this one
+    for _, writer, _ in pool[1]:
         writer.close()
-        await writer.wait_closed()
+    await asyncio.gather(
+        *(writer.wait_closed() for _, writer, _ in pool[1]), return_exceptions=True
+    )
+
+
+# Bytes asked of the socket per read while collecting a response
+_READ_CHUNK = 64 * 1024
 
 
 async def mpd_command(
     reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cmd: str
 ) -> list[str]:
-    """Send command and read response lines until OK or ACK."""
-    writer.write(f"{cmd}\n".encode())
-    await writer.drain()
-
-    lines = []
-    while True:
-        line = await reader.readline()
-        if not line:
-            raise MPDError("Connection closed")
-        line = line.decode("utf-8", errors="replace").rstrip("\n")
-        if line == "OK":
-            break
-        if line.startswith("ACK"):
-            raise MPDError(line)
-        lines.append(line)
+    """Send command and read response lines until OK or ACK.
+
+    The response is read in large chunks rather than line by line, and
+    decoded once. Only one command (or command list) is in flight at a time,
+    so the first complete OK or ACK line ends the response and nothing past
+    it is read.
+    """
+    try:
+        writer.write(f"{cmd}\n".encode())
+        await writer.drain()
+
+        buf = bytearray()
+        while True:
+            chunk = await asyncio.wait_for(reader.read(_READ_CHUNK), _READ_TIMEOUT)
+            if not chunk:
+                raise MPDError("Connection closed")
+            buf += chunk
+            if not buf.endswith(b"\n"):
+                continue
+            # Only the last complete line can be the OK/ACK terminator
+            last_start = buf.rfind(b"\n", 0, len(buf) - 1) + 1
+            last = bytes(buf[last_start:-1])
+            if last == b"OK" or last.startswith(b"ACK"):
+                break
+    except asyncio.TimeoutError:  # an OSError too, from Python 3.11 on
+        raise MPDError("Timed out waiting for MPD") from None
+    except OSError as e:  # e.g. MPD reset the connection
+        raise MPDError(f"Connection lost: {e}") from e
+
+    if last.startswith(b"ACK"):
+        raise MPDError(last.decode("utf-8", errors="replace"))
+    lines = buf[:last_start].decode("utf-8", errors="replace").split("\n")
+    lines.pop()  # empty text after the final newline
     return lines
 
 
+async def mpd_command_list(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cmds: list[str]
+) -> list[list[str]]:
+    """Send cmds as one command list, return each command's response lines.
+
+    The whole batch takes a single round trip. MPD stops at the first failing
+    command, which raises MPDError as in mpd_command.
+    """
+    batch = "\n".join(["command_list_ok_begin", *cmds, "command_list_end"])
+    responses: list[list[str]] = [[]]
+    for line in await mpd_command(reader, writer, batch):
+        if line == "list_OK":
+            responses.append([])
+        else:
+            responses[-1].append(line)
+    responses.pop()  # nothing follows the last list_OK
+    return responses
+
+
 def parse_response(lines: list[str]) -> dict:
     """Parse key: value lines into dict."""
     result = {}
     for line in lines:
-        if ": " in line:
-            key, value = line.split(": ", 1)
+        key, sep, value = line.partition(": ")
+        if sep:
             result[key] = value
     return result
 
 
-def parse_list_response(lines: list[str]) -> list[dict]:
-    """Parse multi-item response (like lsinfo) into list of dicts."""
+# Keys that start a new item in list responses
+_ITEM_KEYS = frozenset(("file", "directory", "playlist"))
+
+
+def parse_list_response(
+    lines: list[str], keys: frozenset[str] | None = None
+) -> list[dict]:
+    """Parse multi-item response (like lsinfo) into list of dicts.
+
+    If keys is given, other tags (besides the item keys) are left out, which
+    keeps big listings such as listallinfo small.
+    """
     items = []
     current: dict = {}
     for line in lines:
-        if ": " in line:
-            key, value = line.split(": ", 1)
-            # New item starts with file/directory/playlist
-            if key in ("file", "directory", "playlist") and current:
+        key, sep, value = line.partition(": ")
+        if not sep:
+            continue
+        # New item starts with file/directory/playlist
+        if key in _ITEM_KEYS:
+            if current:
                 items.append(current)
-                current = {}
+            current = {key: value}
+        elif keys is None or key in keys:
             current[key] = value
     if current:
         items.append(current)
     return items
 
 
+def _command_string(cmd_parts: list[str]) -> str:
+    """Build a command line from a command and its arguments."""
+    cmd = cmd_parts[0]
+    args = cmd_parts[1:] if len(cmd_parts) > 1 else []
+    if args:
+        # Quote args with spaces
+        quoted_args = [f'"{a}"' if " " in a else a for a in args]
+        return f"{cmd} {' '.join(quoted_args)}"
+    return cmd
+
+
 async def player_command(commands: list[list[str]]) -> dict:
     """Execute MPD player commands."""
+    cmds = [_command_string(cmd_parts) for cmd_parts in commands]
     async with mpd_connection() as (reader, writer):
+        # The commands, then the current status and song, in one round trip
+        *responses, status_lines, song_lines = await mpd_command_list(
+            reader, writer, [*cmds, "status", "currentsong"]
+        )
         result = {}
-        for cmd_parts in commands:
-            cmd = cmd_parts[0]
-            args = cmd_parts[1:] if len(cmd_parts) > 1 else []
-
-            # Build command string
-            if args:
-                # Quote args with spaces
-                quoted_args = [f'"{a}"' if " " in a else a for a in args]
-                cmd_str = f"{cmd} {' '.join(quoted_args)}"
-            else:
-                cmd_str = cmd
-
-            lines = await mpd_command(reader, writer, cmd_str)
-            if lines:
-                result.update(parse_response(lines))
-
-        # Always return current status
-        status_lines = await mpd_command(reader, writer, "status")
+        for lines in responses:
+            result.update(parse_response(lines))
         result.update(parse_response(status_lines))
 
-        # Get current song info if playing (with its rating, if any)
+        # Include the current song if playing (with its rating, if any)
         if result.get("state") in ("play", "pause"):
-            song = parse_response(await mpd_command(reader, writer, "currentsong"))
+            song = parse_response(song_lines)
             uri = song.get("file")
             if uri:
                 stars = await song_rating(reader, writer, uri)
@@ -139,11 +282,7 @@ async def browse_directory(paths: list[str]) -> dict:
             directories = []
             for item in items:
                 if "file" in item:
-                    entry = {
-                        "file": item["file"],
-                        "title": item.get("Title", item["file"].split("/")[-1]),
-                        "duration": item.get("Time", ""),
-                    }
+                    entry = _file_entry(item)
                     stars = ratings.get(item["file"])
                     if stars is not None:
                         entry["rating"] = stars
@@ -178,9 +317,94 @@ async def play_tracks(
 _cache: dict[tuple, tuple[list[dict], float]] = {}
 
 
+# Inline flags at the start of a pattern, e.g. "(?i)audiobooks"
+_LEADING_FLAGS = re.compile(r"\(\?([aiLmsux]+)\)")
+
+
+def _as_group(pattern: str) -> str:
+    """Wrap a pattern for an alternation, keeping leading flags scoped to it."""
+    if m := _LEADING_FLAGS.match(pattern):
+        return f"(?{m[1]}:{pattern[m.end():]})"
+    return f"(?:{pattern})"
+
+
+@functools.lru_cache(maxsize=64)
+def _skip_matcher(patterns: tuple[str, ...]) -> Callable[[str], bool]:
+    """Build a check for paths matching any of patterns.
+
+    The patterns are compiled once into a single alternation, so each path
+    is searched once rather than once per pattern.
+    """
+    if not patterns:
+        return lambda path: False
+    try:
+        combined = re.compile("|".join(map(_as_group, patterns)))
+    except re.error:
+        # e.g. group names or backreferences that clash once combined
+        compiled = [re.compile(p) for p in patterns]
+        return lambda path: any(p.search(path) for p in compiled)
+    return lambda path: combined.search(path) is not None
+
+
 def _should_skip(path: str, patterns: list[str]) -> bool:
     """Check if path matches any skip pattern."""
-    return any(re.search(p, path) for p in patterns)
+    return _skip_matcher(tuple(patterns))(path)
+
+
+# The tags _file_entry reads
+_FILE_ENTRY_TAGS = frozenset(("Title", "Time"))
+
+
+def _file_entry(item: dict) -> dict:
+    """Listing entry for an MPD song item."""
+    return {
+        "file": item["file"],
+        "title": item.get("Title", item["file"].split("/")[-1]),
+        "duration": item.get("Time", ""),
+    }
+
+
+def _in_any_dir(uri: str, dirs: set[str]) -> bool:
+    """Check if uri lies below any of dirs (checking each ancestor once)."""
+    end = uri.rfind("/")
+    while end > 0:
+        if uri[:end] in dirs:
+            return True
+        end = uri.rfind("/", 0, end)
+    return False
+
+
+async def _get_all_files_listall(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    path: str,
+    skip_patterns: list[str],
+) -> list[dict]:
+    """Get all files under a path with a single listallinfo command.
+
+    Gives the same files as _get_all_files_recursive: besides files matching
+    a skip pattern, everything below a skipped directory is dropped too.
+    """
+    should_skip = _skip_matcher(tuple(skip_patterns))
+    if should_skip(path):
+        return []
+
+    cmd = f'listallinfo "{path}"' if path else "listallinfo"
+    items = parse_list_response(
+        await mpd_command(reader, writer, cmd), keys=_FILE_ENTRY_TAGS
+    )
+    skipped_dirs = {
+        item["directory"]
+        for item in items
+        if "directory" in item and should_skip(item["directory"])
+    }
+    return [
+        _file_entry(item)
+        for item in items
+        if "file" in item
+        and not should_skip(item["file"])
+        and not (skipped_dirs and _in_any_dir(item["file"], skipped_dirs))
+    ]
 
 
 async def _get_all_files_recursive(
@@ -189,8 +413,9 @@ async def _get_all_files_recursive(
     path: str,
     skip_patterns: list[str],
 ) -> list[dict]:
-    """Recursively get all files under a path."""
-    if _should_skip(path, skip_patterns):
+    """Recursively get all files under a path, one lsinfo per directory."""
+    should_skip = _skip_matcher(tuple(skip_patterns))
+    if should_skip(path):
         return []
 
     cmd = f'lsinfo "{path}"' if path else "lsinfo"
@@ -200,14 +425,8 @@ async def _get_all_files_recursive(
     files = []
     for item in items:
         if "file" in item:
-            if not _should_skip(item["file"], skip_patterns):
-                files.append(
-                    {
-                        "file": item["file"],
-                        "title": item.get("Title", item["file"].split("/")[-1]),
-                        "duration": item.get("Time", ""),
-                    }
-                )
+            if not should_skip(item["file"]):
+                files.append(_file_entry(item))
         elif "directory" in item:
             subfiles = await _get_all_files_recursive(
                 reader, writer, item["directory"], skip_patterns
@@ -228,8 +447,16 @@ async def get_all_files(path: str = "", skip: list[str] | None = None) -> list[d
         if time.time() - ts < CACHE_TIMEOUT:
             return cached
 
-    async with mpd_connection() as (reader, writer):
-        files = await _get_all_files_recursive(reader, writer, path, patterns)
+    try:
+        async with mpd_connection() as (reader, writer):
+            files = await _get_all_files_listall(reader, writer, path, patterns)
+    except MPDError:
+        # e.g. a database plugin without listallinfo, or the listing
+        # overflowing max_output_buffer_size, in which case MPD drops the
+        # client; leaving the block discarded the connection, so walk the
+        # tree on a new one
+        async with mpd_connection() as (reader, writer):
+            files = await _get_all_files_recursive(reader, writer, path, patterns)
 
     _cache[key] = (files, time.time())
     return files
@@ -40,6 +40,26 @@ class RatingEntry(TypedDict, total=False):
     ap_status: str
 
 
+# orjson is an optional speedup, as for the anime history; without it the
+# stdlib json module reads and writes the same JSONL format
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_line(entry: RatingEntry) -> bytes:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+
+else:
+    _json_loads = json.loads
+
+    def _json_line(entry: RatingEntry) -> bytes:
+        return (json.dumps(entry) + "\n").encode()
+
+
 @contextmanager
 def _ratings_lock():
     RATINGS_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
@@ -62,20 +82,21 @@ def _load_entries() -> list[RatingEntry]:
     if not RATINGS_FILE.exists():
         return []
     entries: list[RatingEntry] = []
-    for i, line in enumerate(RATINGS_FILE.read_text().splitlines(), 1):
-        if not line.strip():
-            continue
-        try:
-            entries.append(json.loads(line))
-        except json.JSONDecodeError:
-            logger.warning(f"Malformed JSON at line {i} in ratings file")
+    with RATINGS_FILE.open("rb") as f:
+        for i, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entries.append(_json_loads(line))
+            except json.JSONDecodeError:  # orjson's error subclasses this
+                logger.warning(f"Malformed JSON at line {i} in ratings file")
     return entries
 
 
 def _append_unlocked(entry: RatingEntry) -> None:
     RATINGS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(RATINGS_FILE, "a") as f:
-        f.write(json.dumps(entry) + "\n")
+    with open(RATINGS_FILE, "ab") as f:
+        f.write(_json_line(entry))
 
 
 def write_rating(
@@ -1,15 +1,18 @@
 """Torrent file handling and nyaa.si fetching."""
 
+import asyncio
 import logging
+import os
 import shutil
 import re
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import TypedDict
-from urllib.parse import quote_plus
+from typing import AsyncIterator, Iterator, TypedDict
+from urllib.parse import urlencode
 from urllib.request import urlretrieve
 
 import httpx
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from local_mcp.settings import (
     ANIME_BASE_PATH as BASE_PATH,
@@ -19,6 +22,10 @@ from local_mcp.settings import (
 logger = logging.getLogger(__name__)
 
 NYAA_BASE_URL = "https://nyaa.si"
+NYAA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; anime-checker/1.0)",
+    "Accept-Encoding": "gzip, deflate",
+}
 
 # Regex for torrent titles (no .mkv, handles language tags like (JA))
 TORRENT_NAME_REGEX = re.compile(
@@ -42,41 +49,75 @@ class TorrentInfo(TypedDict):
 # --- Bencode parsing ---
 
 
-def _bdecode(data: bytes, idx: int = 0) -> tuple:
-    """Decode bencode data, return (value, next_index)."""
-    c = chr(data[idx])
-    if c == "i":  # integer: i<num>e
+# Byte values of the bencode type markers (indexing bytes gives ints)
+_INT, _LIST, _DICT, _END = b"ilde"
+_DIGITS = range(ord("0"), ord("9") + 1)
+
+
+def _bskip(data: bytes, idx: int) -> int:
+    """Return the index just past the bencoded value at idx, without decoding it."""
+    c = data[idx]
+    if c == _INT:
+        return data.index(b"e", idx) + 1
+    elif c == _LIST or c == _DICT:  # dict keys and values alternate, so skip alike
+        idx += 1
+        while data[idx] != _END:
+            idx = _bskip(data, idx)
+        return idx + 1
+    elif c in _DIGITS:
+        colon = data.index(b":", idx)
+        return colon + 1 + int(data[idx:colon])
+    raise ValueError(f"Invalid bencode at {idx}: {chr(c)!r}")
+
+
+def _bdecode(
+    data: bytes, idx: int = 0, keys: frozenset[str] | None = None
+) -> tuple:
+    """Decode bencode data, return (value, next_index).
+
+    If keys is given, dict entries with other keys (at any depth) are skipped
+    over rather than decoded.
+    """
+    c = data[idx]
+    if c == _INT:  # integer: i<num>e
         end = data.index(b"e", idx)
         return int(data[idx + 1 : end]), end + 1
-    elif c == "l":  # list: l<items>e
+    elif c == _LIST:  # list: l<items>e
         items, idx = [], idx + 1
-        while chr(data[idx]) != "e":
-            val, idx = _bdecode(data, idx)
+        while data[idx] != _END:
+            val, idx = _bdecode(data, idx, keys)
             items.append(val)
         return items, idx + 1
-    elif c == "d":  # dict: d<key><val>...e
+    elif c == _DICT:  # dict: d<key><val>...e
         d, idx = {}, idx + 1
-        while chr(data[idx]) != "e":
+        while data[idx] != _END:
             key, idx = _bdecode(data, idx)
-            val, idx = _bdecode(data, idx)
-            d[key.decode() if isinstance(key, bytes) else key] = val
+            key = key.decode() if isinstance(key, bytes) else key
+            if keys is None or key in keys:
+                d[key], idx = _bdecode(data, idx, keys)
+            else:
+                idx = _bskip(data, idx)
         return d, idx + 1
-    elif c.isdigit():  # string: <len>:<bytes>
+    elif c in _DIGITS:  # string: <len>:<bytes>
         colon = data.index(b":", idx)
         length = int(data[idx:colon])
         start = colon + 1
         return data[start : start + length], start + length
-    raise ValueError(f"Invalid bencode at {idx}: {c!r}")
+    raise ValueError(f"Invalid bencode at {idx}: {chr(c)!r}")
 
 
 VIDEO_EXTENSIONS = (".mkv", ".mp4", ".avi", ".webm")
 
+# The only dict keys video_filename reads; everything else, notably the
+# multi-megabyte "pieces" hash string, is skipped without being sliced out
+_VIDEO_FILENAME_KEYS = frozenset(("info", "name", "files", "path", "length"))
+
 
 def video_filename(torrent_path: Path) -> str | None:
     """Extract video filename from a torrent file."""
     try:
         data = torrent_path.read_bytes()
-        info = _bdecode(data)[0].get("info", {})
+        info = _bdecode(data, keys=_VIDEO_FILENAME_KEYS)[0].get("info", {})
 
         # Single file torrent
         if "name" in info and "files" not in info:
@@ -119,6 +160,14 @@ def ensure_watch_dir():
     WATCH_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def _dest_for(torrent: str, fallback_name: str | None = None) -> Path:
+    """Path in the watch directory that a torrent URL is saved to."""
+    filename = torrent.split("/")[-1]
+    if not filename.endswith(".torrent") and fallback_name:
+        filename = fallback_name
+    return WATCH_DIR / filename
+
+
 def download(torrent: str, fallback_name: str | None = None) -> Path:
     """Copy or download a torrent file to the watch directory.
 
@@ -135,10 +184,7 @@ def download(torrent: str, fallback_name: str | None = None) -> Path:
     ensure_watch_dir()
 
     if torrent.startswith(("http://", "https://")):
-        filename = torrent.split("/")[-1]
-        if not filename.endswith(".torrent") and fallback_name:
-            filename = fallback_name
-        dest = WATCH_DIR / filename
+        dest = _dest_for(torrent, fallback_name)
         urlretrieve(torrent, dest)
     else:
         src = Path(torrent)
@@ -151,19 +197,78 @@ def download(torrent: str, fallback_name: str | None = None) -> Path:
     return dest
 
 
+async def download_async(
+    torrent: str,
+    fallback_name: str | None = None,
+    client: httpx.AsyncClient | None = None,
+) -> Path:
+    """Like download(), but fetches URLs without blocking the event loop.
+
+    URLs are streamed to the watch directory over client (e.g. the
+    nyaa_client() the releases were found with); local paths are copied
+    by download() in a worker thread.
+    """
+    if not torrent.startswith(("http://", "https://")):
+        return await asyncio.to_thread(download, torrent, fallback_name)
+
+    ensure_watch_dir()
+    dest = _dest_for(torrent, fallback_name)
+    # The torrent client watches for *.torrent, so stream under another name
+    # and only move the file into place once it is complete
+    tmp = dest.with_name(dest.name + ".part")
+    try:
+        async with _client_or_new(client) as client:
+            async with client.stream(
+                "GET", torrent, timeout=30.0, follow_redirects=True
+            ) as response:
+                response.raise_for_status()
+                with open(tmp, "wb") as f:
+                    async for chunk in response.aiter_bytes(64 * 1024):
+                        f.write(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return dest
+
+
 # --- Nyaa.si fetching ---
 
 
+def nyaa_client() -> httpx.AsyncClient:
+    """HTTP client for nyaa.si.
+
+    Pass one to several fetches so they share its connection pool instead of
+    each paying for a new connection and TLS handshake.
+    """
+    return httpx.AsyncClient(headers=NYAA_HEADERS)
+
+
+@asynccontextmanager
+async def _client_or_new(
+    client: httpx.AsyncClient | None,
+) -> AsyncIterator[httpx.AsyncClient]:
+    """Use the caller's client, or open (and close) a fresh one."""
+    if client is not None:
+        yield client
+    else:
+        async with nyaa_client() as client:
+            yield client
+
+
 def _parse_row(row) -> TorrentInfo | None:
     """Parse a single nyaa.si result row."""
-    cells = row.find_all("td")
+    # Only the row's own cells: html.parser nests the next row inside one
+    # whose </tr> was omitted
+    cells = row.find_all("td", recursive=False)
     if len(cells) < 8:
         return None
 
     cat, name, dl, size, date, seeds, leeches, status = cells
-    title_link = name.find_all("a")[-1] if name.find_all("a") else None
-    if not title_link:
+    links = name.find_all("a")
+    if not links:
         return None
+    title_link = links[-1]
 
     match = TORRENT_NAME_REGEX.match(title_link.get("title", ""))
     if not match:
@@ -190,37 +295,64 @@ def _parse_row(row) -> TorrentInfo | None:
     )
 
 
-async def fetch_group_releases(group: str, pages: int = 3) -> list[TorrentInfo]:
+# lxml is an optional, much faster tree builder; without it bs4's pure-Python
+# html.parser builds the same rows
+try:
+    import lxml  # noqa: F401
+except ImportError:  # pragma: no cover - depends on the environment
+    HTML_PARSER = "html.parser"
+else:
+    HTML_PARSER = "lxml"
+
+# Only the rows are built; anything else on the page is skipped while parsing
+_ROWS = SoupStrainer("tr")
+
+
+def _parse_page(html: str) -> Iterator[TorrentInfo]:
+    """Parse every result row of a nyaa.si listing page.
+
+    Rows are yielded straight into the caller's results, without an
+    intermediate list per page.
+    """
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=_ROWS)
+    # class_ matches any token of the class list, so "success odd" rows count
+    for row in soup.find_all("tr", class_="success"):
+        if info := _parse_row(row):
+            yield info
+
+
+def _search_url(query: str, page: int = 1) -> str:
+    """URL of a nyaa.si search results page.
+
+    f=2 = trusted only, c=1_2 = Anime English-translated.
+    """
+    params = {"f": "2", "c": "1_2", "q": query}
+    if page > 1:
+        params["p"] = str(page)
+    return f"{NYAA_BASE_URL}/?{urlencode(params)}"
+
+
+async def fetch_group_releases(
+    group: str, pages: int = 3, client: httpx.AsyncClient | None = None
+) -> list[TorrentInfo]:
     """Fetch recent releases from a trusted group via nyaa.si search.
 
     Args:
         group: Group name to search for
         pages: Number of pages to fetch (each ~75 results)
+        client: Shared client from nyaa_client(); a new one is opened if None
 
     Returns:
         List of parsed torrent info dicts
     """
     results = []
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; anime-checker/1.0)",
-        "Accept-Encoding": "gzip, deflate",
-    }
-
-    async with httpx.AsyncClient(headers=headers) as client:
+    async with _client_or_new(client) as client:
         for page in range(1, pages + 1):
-            # f=2 = trusted only, c=1_2 = Anime English-translated
-            url = f"{NYAA_BASE_URL}/?f=2&c=1_2&q={group}"
-            if page > 1:
-                url += f"&p={page}"
-
-            response = await client.get(url, timeout=30.0)
+            response = await client.get(_search_url(group, page), timeout=30.0)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.text, "html.parser")
-            for row in soup.find_all("tr", attrs={"class": "success"}):
-                if info := _parse_row(row):
-                    results.append(info)
+            results.extend(_parse_page(response.text))
 
     return results
 
@@ -230,27 +362,18 @@ async def search_releases(
     group: str = "SubsPlease",
     quality: str = "1080",
     pages: int = 1,
+    client: httpx.AsyncClient | None = None,
 ) -> list[TorrentInfo]:
     """Search nyaa.si for a series by name within a trusted group.
 
     Same trusted/English filters as fetch_group_releases (f=2, c=1_2).
     """
     results = []
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; anime-checker/1.0)",
-        "Accept-Encoding": "gzip, deflate",
-    }
-    q = quote_plus(f"{group} {query} {quality}")
+    q = f"{group} {query} {quality}"
 
-    async with httpx.AsyncClient(headers=headers) as client:
+    async with _client_or_new(client) as client:
         for page in range(1, pages + 1):
-            url = f"{NYAA_BASE_URL}/?f=2&c=1_2&q={q}"
-            if page > 1:
-                url += f"&p={page}"
-            response = await client.get(url, timeout=30.0)
+            response = await client.get(_search_url(q, page), timeout=30.0)
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, "html.parser")
-            for row in soup.find_all("tr", attrs={"class": "success"}):
-                if info := _parse_row(row):
-                    results.append(info)
+            results.extend(_parse_page(response.text))
     return results
@@ -1,6 +1,7 @@
 """Local MCP server entry point."""
 
 import base64
+from contextlib import asynccontextmanager
 
 import uvicorn
 from fastmcp import FastMCP
@@ -10,6 +11,7 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 
 from local_mcp.auth import HtpasswdAuth
+from local_mcp.lib import music
 from local_mcp.settings import SERVER_PORT, TOKEN_DB_PATH
 from local_mcp.token_db import TokenDB
 from local_mcp.tools import anime_mcp, music_mcp
@@ -29,11 +31,23 @@ class InjectClientIdMiddleware(BaseHTTPMiddleware):
         return await call_next(request)
 
 
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Close the pooled MPD connections when the server stops."""
+    try:
+        yield
+    finally:
+        await music.close_connections()
+
+
+token_db = TokenDB(TOKEN_DB_PATH)
+
 # Create the MCP server with auth always enabled
 mcp = FastMCP(
     name="local-mcp",
     instructions="Local MCP server with music/MPD control and anime download tools.",
-    auth=HtpasswdAuth(db=TokenDB(TOKEN_DB_PATH)),
+    auth=HtpasswdAuth(db=token_db),
+    lifespan=lifespan,
 )
 
 # Mount tool subservers
@@ -60,7 +74,11 @@ def main() -> None:
         middleware=custom_middleware,
         stateless_http=True,
     )
-    uvicorn.run(http_app, host="0.0.0.0", port=SERVER_PORT)
+    try:
+        uvicorn.run(http_app, host="0.0.0.0", port=SERVER_PORT)
+    finally:
+        # Save OAuth changes still waiting for their delayed write
+        token_db.flush()
 
 
 if __name__ == "__main__":
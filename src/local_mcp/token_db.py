@@ -1,13 +1,44 @@
-"""JSON-backed token database for OAuth state persistence."""
+"""JSONL-backed token database for OAuth state persistence."""
 
+import asyncio
+import heapq
+import hmac
 import json
+import os
 import time
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Literal
 
 from mcp.shared.auth import OAuthClientInformationFull
-from pydantic import AnyUrl
+from pydantic import AnyUrl, BaseModel, ValidationError
+
+
+# Separates a token's short lookup key from its secret part. Not in the
+# token_urlsafe alphabet, so it can never appear inside either half.
+TOKEN_KEY_SEP = "."
+
+
+def token_key(token: str) -> str:
+    """Index key for a token: the short part before TOKEN_KEY_SEP.
+
+    Tokens minted by HtpasswdAuth look like ``at_<key>.<secret>``; tokens
+    without a separator (e.g. issued before keys existed) are their own key.
+    """
+    return token.partition(TOKEN_KEY_SEP)[0]
+
+
+def _secret_matches(stored: str, presented: str) -> bool:
+    """Constant-time check that a presented token/code is the stored one."""
+    return hmac.compare_digest(stored.encode(), presented.encode())
+
+
+class TokenKeyCollision(ValueError):
+    """A new token or code has the same key as a different live one."""
+
+
+# The field holding the full token/code, for tables indexed by token_key
+_SECRET_FIELDS = {"tokens": "token", "auth_codes": "code"}
 
 
 class PermissiveClient(OAuthClientInformationFull):
@@ -18,7 +49,10 @@ class PermissiveClient(OAuthClientInformationFull):
         return AnyUrl(redirect_uri)
 
 
-@dataclass
+TokenKind = Literal["access", "refresh"]
+
+
+@dataclass(slots=True)
 class StoredToken:
     """Stored token information."""
 
@@ -27,9 +61,14 @@ class StoredToken:
     scopes: list[str]
     expires_at: float
     client_id: str
+    kind: TokenKind = "access"
+
+    @property
+    def token_key(self) -> str:
+        return token_key(self.token)
 
 
-@dataclass
+@dataclass(slots=True)
 class StoredAuthCode:
     """Authorization code for OAuth flow."""
 
@@ -43,7 +82,7 @@ class StoredAuthCode:
     redirect_uri_provided_explicitly: bool = True
 
 
-@dataclass
+@dataclass(slots=True)
 class PendingAuth:
     """Pending authorization request waiting for login."""
 
@@ -54,129 +93,407 @@ class PendingAuth:
     code_challenge: str | None
     expires_at: float
     redirect_uri_provided_explicitly: bool = True
+    # Joins the auth code query onto redirect_uri; derived once on creation
+    separator: str = ""
+
+    def __post_init__(self) -> None:
+        if not self.separator:
+            self.separator = "&" if "?" in self.redirect_uri else "?"
+
+
+# Changes made while an event loop runs are written this long after the
+# first of them, so a burst of mutations (e.g. one OAuth flow) is one write
+FLUSH_DELAY = 0.5
+
+# The log is rewritten as a snapshot once it has this many lines and more than
+# COMPACT_RATIO times the number of live entries
+COMPACT_MIN_LINES = 100
+COMPACT_RATIO = 4
+
+
+def _decode(table: str, value: dict) -> Any:
+    """Build a table's entry from its JSON form."""
+    if table == "tokens":
+        return StoredToken(**value)
+    elif table == "auth_codes":
+        return StoredAuthCode(**value)
+    elif table == "pending_auths":
+        return PendingAuth(**value)
+    elif table == "clients":
+        return value  # validated by get_client on first use
+    raise KeyError(table)
+
+
+def _to_json(entry: Any) -> dict:
+    """JSON form of a table entry, for the encoders' default hook."""
+    if isinstance(entry, BaseModel):
+        return entry.model_dump(mode="json")
+    return asdict(entry)
+
+
+# orjson is an optional speedup for the log (de)serialisation; it writes
+# dataclasses natively, and without it the stdlib json module reads and
+# writes the same format
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_line(record: dict) -> bytes:
+        return orjson.dumps(
+            record, default=_to_json, option=orjson.OPT_APPEND_NEWLINE
+        )
+
+else:
+    _json_loads = json.loads
+
+    def _json_line(record: dict) -> bytes:
+        return (json.dumps(record, default=_to_json) + "\n").encode()
+
+
+def _write_synced(f: BinaryIO, data: bytes) -> None:
+    """Write data and flush it to disk before returning."""
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
 
 
 class TokenDB:
-    """JSON-backed token database."""
+    """JSONL-backed token database.
+
+    Access and refresh tokens share one table, told apart by StoredToken.kind.
+    Tokens and auth codes are indexed by their token_key (the column an SQL
+    backend would index); the full value is then compared in constant time,
+    so a lookup never depends on a scan or a timing-unsafe equality.
+
+    The file is a log: an optional snapshot line of every table, then one
+    line per changed key ({"op": "set", ...} or {"op": "del", ...}), so a save
+    appends just the changed keys. Once mostly stale it is rewritten as a
+    single snapshot. Changes are saved FLUSH_DELAY after they are made when an
+    event loop is running, and at once otherwise; call flush() before
+    shutting down.
+    """
 
     def __init__(self, db_path: Path):
         self._path = db_path
-        self._tokens: dict[str, StoredToken] = {}
+        self._all_tokens: dict[str, StoredToken] = {}
         self._auth_codes: dict[str, StoredAuthCode] = {}
-        self._refresh_tokens: dict[str, StoredToken] = {}
-        self._clients: dict[str, PermissiveClient] = {}
+        # Clients stay as loaded JSON until first asked for, since pydantic
+        # validation costs more than everything else on startup
+        self._clients: dict[str, PermissiveClient | dict] = {}
         self._pending_auths: dict[str, PendingAuth] = {}
+        self._tables: dict[str, dict[str, Any]] = {
+            "tokens": self._all_tokens,
+            "auth_codes": self._auth_codes,
+            "pending_auths": self._pending_auths,
+        }
+        self._saved_tables: dict[str, dict[str, Any]] = {
+            **self._tables,
+            "clients": self._clients,
+        }
+        # (table name, key) of changes not yet in the file
+        self._unsaved: set[tuple[str, str]] = set()
+        # The pending flush timer, with the event loop it runs on
+        self._flush_handle: tuple[asyncio.AbstractEventLoop, asyncio.TimerHandle] | None = None
+        self._log_lines = 0
+        self._rewrite = False
         self._load()
+        # Min-heap of (expires_at, table name, key). Entries go stale when their
+        # key is popped or overwritten; cleanup_expired skips those.
+        self._expiry: list[tuple[float, str, str]] = [
+            (v.expires_at, name, k)
+            for name, table in self._tables.items()
+            for k, v in table.items()
+        ]
+        heapq.heapify(self._expiry)
 
     def _load(self) -> None:
-        """Load state from JSON file."""
+        """Replay the log file into the tables."""
         if not self._path.exists():
             return
 
+        data = self._path.read_bytes()
+        # Appending after an unterminated line would merge into it
+        self._rewrite = bool(data) and not data.endswith(b"\n")
         try:
-            data = json.loads(self._path.read_text())
-            self._tokens = {
-                k: StoredToken(**v) for k, v in data.get("tokens", {}).items()
-            }
-            self._auth_codes = {
-                k: StoredAuthCode(**v) for k, v in data.get("auth_codes", {}).items()
-            }
-            self._refresh_tokens = {
-                k: StoredToken(**v) for k, v in data.get("refresh_tokens", {}).items()
-            }
-            self._pending_auths = {
-                k: PendingAuth(**v) for k, v in data.get("pending_auths", {}).items()
-            }
-            for client_id, client_data in data.get("clients", {}).items():
-                self._clients[client_id] = PermissiveClient.model_validate(client_data)
-        except (json.JSONDecodeError, TypeError, KeyError):
-            pass  # Start fresh on corruption
+            whole = _json_loads(data)
+        except json.JSONDecodeError:  # orjson's error subclasses this
+            whole = None
+        if self._is_legacy_snapshot(whole):
+            # Before the log format the file was one indented snapshot, which
+            # has to be rewritten as a single line before anything is appended
+            records = [whole]
+            self._rewrite = True
+        else:
+            records = []
+            for line in data.splitlines():
+                try:
+                    records.append(_json_loads(line))
+                except json.JSONDecodeError:
+                    continue  # Skip corrupt lines, e.g. a torn last append
+        for record in records:
+            try:
+                self._apply(record)
+            except (TypeError, KeyError, ValueError, AttributeError):
+                continue
+        self._log_lines = len(records)
+
+    def _is_legacy_snapshot(self, value: Any) -> bool:
+        """Whether a parsed file is a snapshot written before the log format."""
+        return (
+            isinstance(value, dict)
+            and "op" not in value
+            and any(name in value for name in (*self._saved_tables, "refresh_tokens"))
+        )
+
+    def _apply(self, record: dict) -> None:
+        """Apply one log line to the tables."""
+        op = record.get("op")
+        if op == "set":
+            table = record["table"]
+            self._saved_tables[table][record["key"]] = _decode(table, record["value"])
+        elif op == "del":
+            self._saved_tables[record["table"]].pop(record["key"], None)
+        elif op == "snapshot" or op is None:  # None: from before the log format
+            tables = record["tables"] if op else record
+            for name, table in self._saved_tables.items():
+                table.clear()
+                table.update(
+                    (k, _decode(name, v)) for k, v in tables.get(name, {}).items()
+                )
+            # Files written before the tables were merged keep refresh tokens apart
+            for k, v in record.get("refresh_tokens", {}).items():
+                self._all_tokens[k] = StoredToken(**v, kind="refresh")
+
+    def _log_record(self, name: str, key: str) -> dict:
+        """Log record giving a key's current state."""
+        entry = self._saved_tables[name].get(key)
+        if entry is None:
+            return {"op": "del", "table": name, "key": key}
+        return {"op": "set", "table": name, "key": key, "value": entry}
 
     def _save(self) -> None:
-        """Persist state to JSON file."""
-        data: dict[str, Any] = {
-            "tokens": {k: asdict(v) for k, v in self._tokens.items()},
-            "auth_codes": {k: asdict(v) for k, v in self._auth_codes.items()},
-            "refresh_tokens": {k: asdict(v) for k, v in self._refresh_tokens.items()},
-            "pending_auths": {k: asdict(v) for k, v in self._pending_auths.items()},
-            "clients": {k: v.model_dump(mode="json") for k, v in self._clients.items()},
-        }
-        self._path.write_text(json.dumps(data, indent=2))
-
-    def cleanup_expired(self) -> None:
-        """Remove expired tokens and codes."""
-        now = time.time()
-        self._tokens = {k: v for k, v in self._tokens.items() if v.expires_at > now}
-        self._auth_codes = {
-            k: v for k, v in self._auth_codes.items() if v.expires_at > now
-        }
-        self._refresh_tokens = {
-            k: v for k, v in self._refresh_tokens.items() if v.expires_at > now
-        }
-        self._pending_auths = {
-            k: v for k, v in self._pending_auths.items() if v.expires_at > now
-        }
-        self._save()
+        """Append the unsaved changes to the log, or compact it."""
+        live = sum(map(len, self._saved_tables.values()))
+        lines = self._log_lines + len(self._unsaved)
+        if self._rewrite or (
+            lines >= COMPACT_MIN_LINES and lines > COMPACT_RATIO * live
+        ):
+            self._compact()
+        else:
+            data = b"".join(
+                _json_line(self._log_record(name, key)) for name, key in self._unsaved
+            )
+            with open(self._path, "ab") as f:
+                _write_synced(f, data)
+            self._log_lines = lines
+        self._unsaved.clear()
+
+    def _compact(self) -> None:
+        """Atomically rewrite the log as a single snapshot line.
+
+        The snapshot is on disk before it replaces the log, so a crash leaves
+        either the old log or the new one, never an empty or partial file.
+        """
+        tmp = self._path.with_name(self._path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            _write_synced(f, _json_line({"op": "snapshot", "tables": self._saved_tables}))
+        os.replace(tmp, self._path)
+        self._log_lines = 1
+        self._rewrite = False
+
+    def _mark_dirty(self) -> None:
+        """Schedule saving the keys recorded in _unsaved."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._flush_handle is not None:
+            if self._flush_handle[0] is loop:
+                return  # the pending flush will pick this change up
+            # The timer's loop was closed or stopped, so it may never fire
+            self._flush_handle[1].cancel()
+            self._flush_handle = None
+        if loop is None:
+            self.flush()
+        else:
+            self._flush_handle = (loop, loop.call_later(FLUSH_DELAY, self.flush))
+
+    def flush(self) -> None:
+        """Save any unsaved changes now."""
+        if self._flush_handle is not None:
+            self._flush_handle[1].cancel()
+            self._flush_handle = None
+        if self._unsaved:
+            self._save()
+
+    def _live(
+        self, name: str, key: str, pop: bool = False, now: float | None = None
+    ) -> Any:
+        """Look up (or pop) a key, lazily deleting it if it has expired.
+
+        Callers handling a request can pass the `now` they already read.
+        """
+        table = self._tables[name]
+        entry = table.pop(key, None) if pop else table.get(key)
+        if entry is None:
+            return None
+        expired = entry.expires_at <= (time.time() if now is None else now)
+        if expired and not pop:
+            del table[key]
+        if pop or expired:
+            self._unsaved.add((name, key))
+            self._mark_dirty()
+        return None if expired else entry
+
+    def _check_key_free(self, name: str, key: str, entry: Any) -> None:
+        """Raise TokenKeyCollision if a different live token/code holds `key`.
+
+        Re-setting the same token or code is not a collision.
+        """
+        field = _SECRET_FIELDS.get(name)
+        if field is None:
+            return
+        existing = self._live(name, key)
+        if existing is not None and not _secret_matches(
+            getattr(existing, field), getattr(entry, field)
+        ):
+            raise TokenKeyCollision(key)
+
+    def _track(self, name: str, key: str, entry: Any) -> None:
+        """Store an entry and schedule it for expiry (the caller saves it)."""
+        self._check_key_free(name, key, entry)
+        self._tables[name][key] = entry
+        heapq.heappush(self._expiry, (entry.expires_at, name, key))
+        self._unsaved.add((name, key))
+
+    def cleanup_expired(self, now: float | None = None) -> None:
+        """Remove expired tokens and codes.
+
+        Only the expired heap entries are visited, not every stored entry.
+        """
+        if now is None:
+            now = time.time()
+        removed = False
+        while self._expiry and self._expiry[0][0] <= now:
+            _, name, key = heapq.heappop(self._expiry)
+            table = self._tables[name]
+            entry = table.get(key)
+            # Skip keys already popped, or re-set with a later expiry
+            if entry is not None and entry.expires_at <= now:
+                del table[key]
+                self._unsaved.add((name, key))
+                removed = True
+        if removed:
+            self._mark_dirty()
+
+    def _find_token(
+        self,
+        token: str,
+        kind: TokenKind | None,
+        pop: bool = False,
+        now: float | None = None,
+    ) -> StoredToken | None:
+        """Look up a token by its key, then verify the full token and kind."""
+        key = token_key(token)
+        stored = self._all_tokens.get(key)
+        if stored is None or not _secret_matches(stored.token, token):
+            return None
+        if kind and stored.kind != kind:
+            return None
+        return self._live("tokens", key, pop=pop, now=now)
+
+    def _put_token(self, token: str, data: StoredToken, kind: TokenKind) -> None:
+        self._track(
+            "tokens",
+            token_key(token),
+            data if data.kind == kind else replace(data, kind=kind),
+        )
+
+    def delete_token(self, token: str) -> None:
+        """Remove a token, whichever kind it is."""
+        self._find_token(token, None, pop=True)
 
     # Access tokens
-    def get_token(self, token: str) -> StoredToken | None:
-        return self._tokens.get(token)
+    def get_token(self, token: str, now: float | None = None) -> StoredToken | None:
+        return self._find_token(token, "access", now=now)
 
     def set_token(self, token: str, data: StoredToken) -> None:
-        self._tokens[token] = data
-        self._save()
-
-    def delete_token(self, token: str) -> None:
-        self._tokens.pop(token, None)
-        self._save()
+        self._put_token(token, data, "access")
+        self._mark_dirty()
+
+    def set_token_pair(
+        self, access: str, access_data: StoredToken, refresh: str, refresh_data: StoredToken
+    ) -> None:
+        """Store a freshly minted access + refresh token with a single write."""
+        # Neither is stored if either key is taken
+        self._check_key_free("tokens", token_key(refresh), refresh_data)
+        self._put_token(access, access_data, "access")
+        self._put_token(refresh, refresh_data, "refresh")
+        self._mark_dirty()
 
     # Auth codes
-    def get_auth_code(self, code: str) -> StoredAuthCode | None:
-        return self._auth_codes.get(code)
+    def _find_auth_code(
+        self, code: str, pop: bool = False, now: float | None = None
+    ) -> StoredAuthCode | None:
+        key = token_key(code)
+        stored = self._auth_codes.get(key)
+        if stored is None or not _secret_matches(stored.code, code):
+            return None
+        return self._live("auth_codes", key, pop=pop, now=now)
+
+    def get_auth_code(
+        self, code: str, now: float | None = None
+    ) -> StoredAuthCode | None:
+        return self._find_auth_code(code, now=now)
 
     def set_auth_code(self, code: str, data: StoredAuthCode) -> None:
-        self._auth_codes[code] = data
-        self._save()
+        self._track("auth_codes", token_key(code), data)
+        self._mark_dirty()
 
     def pop_auth_code(self, code: str) -> StoredAuthCode | None:
-        result = self._auth_codes.pop(code, None)
-        self._save()
-        return result
+        return self._find_auth_code(code, pop=True)
 
     # Refresh tokens
-    def get_refresh_token(self, token: str) -> StoredToken | None:
-        return self._refresh_tokens.get(token)
+    def get_refresh_token(
+        self, token: str, now: float | None = None
+    ) -> StoredToken | None:
+        return self._find_token(token, "refresh", now=now)
 
     def set_refresh_token(self, token: str, data: StoredToken) -> None:
-        self._refresh_tokens[token] = data
-        self._save()
+        self._put_token(token, data, "refresh")
+        self._mark_dirty()
 
     def pop_refresh_token(self, token: str) -> StoredToken | None:
-        result = self._refresh_tokens.pop(token, None)
-        self._save()
-        return result
-
-    def delete_refresh_token(self, token: str) -> None:
-        self._refresh_tokens.pop(token, None)
-        self._save()
+        return self._find_token(token, "refresh", pop=True)
 
     # Clients
     def get_client(self, client_id: str) -> PermissiveClient | None:
-        return self._clients.get(client_id)
+        client = self._clients.get(client_id)
+        if isinstance(client, dict):
+            try:
+                client = PermissiveClient.model_validate(client)
+            except ValidationError:
+                del self._clients[client_id]  # corrupt entry; the client re-registers
+                return None
+            self._clients[client_id] = client
+        return client
 
     def set_client(self, client_id: str, client: PermissiveClient) -> None:
         self._clients[client_id] = client
-        self._save()
+        self._unsaved.add(("clients", client_id))
+        self._mark_dirty()
 
     # Pending auths
     def get_pending_auth(self, pending_id: str) -> PendingAuth | None:
-        return self._pending_auths.get(pending_id)
+        return self._live("pending_auths", pending_id)
 
     def set_pending_auth(self, pending_id: str, data: PendingAuth) -> None:
-        self._pending_auths[pending_id] = data
-        self._save()
+        self._track("pending_auths", pending_id, data)
+        self._mark_dirty()
 
     def pop_pending_auth(self, pending_id: str) -> PendingAuth | None:
-        result = self._pending_auths.pop(pending_id, None)
-        self._save()
-        return result
+        return self._live("pending_auths", pending_id, pop=True)
@@ -1,6 +1,7 @@
 """Anime download management tools."""
 
-from datetime import datetime, timezone
+import asyncio
+from pathlib import Path
 from typing import Literal, get_args
 
 from fastmcp import FastMCP
@@ -56,7 +57,7 @@ def anime_library(
 
 
 @mcp.tool()
-def anime_mark(path: str, status: Literal["watched", "stalled", "manual"]) -> dict:
+async def anime_mark(path: str, status: Literal["watched", "stalled", "manual"]) -> dict:
     """
     Mark an episode as watched, stalled, or manual.
 
@@ -67,7 +68,8 @@ def anime_mark(path: str, status: Literal["watched", "stalled", "manual"]) -> di
 
     Returns confirmation of the action taken.
     """
-    return anime.mark_episode(path, status)
+    # The move and synced history write can take a while on slow storage
+    return await asyncio.to_thread(anime.mark_episode, path, status)
 
 
 @mcp.tool()
@@ -95,7 +97,7 @@ def anime_rate(
 
 
 @mcp.tool()
-def anime_add(
+async def anime_add(
     torrent_src: str,
     series: str,
     episode: float,
@@ -120,10 +122,20 @@ def anime_add(
     """
     fallback = f"{series.replace(' ', '_')}_{int(episode)}.torrent"
     try:
-        dest = torrent.download(torrent_src, fallback_name=fallback)
+        dest = await torrent.download_async(torrent_src, fallback_name=fallback)
     except FileNotFoundError as e:
         return {"error": str(e)}
 
+    # Parsing the torrent and the locked, synced history write can block
+    return await asyncio.to_thread(
+        _record_added_torrent, dest, series, episode, group, quality
+    )
+
+
+def _record_added_torrent(
+    dest: Path, series: str, episode: float, group: str | None, quality: str | None
+) -> dict:
+    """Record a torrent anime_add put in the watch directory in the history."""
     video_path = torrent.video_path(dest)
     if not video_path:
         return {"error": f"Could not extract video filename from torrent: {dest}"}
@@ -133,7 +145,7 @@ def anime_add(
 
     anime.write_history_entry(
         anime.HistoryEntry(
-            ts=datetime.now(timezone.utc).isoformat(),
+            ts=anime._now_iso(),
             status="unwatched",
             path=video_path,
             series=series,
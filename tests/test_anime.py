@@ -104,6 +104,37 @@ def test_parse_episode_returns_float():
     assert isinstance(result["episode"], float)
 
 
+@pytest.mark.parametrize("filename", [
+    "[SubsPlease] Frieren - Beyond Journey's End - 01 [1080p].mkv",
+    "[Erai-raws] Sousou no Frieren - 28 END [1080p][Multiple Subtitle].mkv",
+    "[SubsPlease] Mob Psycho 100 - 05 (1080p).mkv",
+    "[SubsPlease] Show (2024) - 01 [1080p].mkv",
+    "[SubsPlease] Show-01[1080p].mkv",
+    "[NoGroup] Show [1080p].mkv",
+    "[Group] 12 [1080p].mkv.part",
+    "[SubsPlease] Show - 01 [1080p]",
+])
+def test_scan_filename_agrees_with_regex(filename):
+    from local_mcp.lib.anime import _scan_filename
+
+    match = ANIME_NAME_REGEX.match(filename)
+    expected = None
+    if match:
+        g = match.groupdict()
+        episode = float(g["episode"]) if g["episode"] else -1
+        expected = (g["group"], g["title"], episode, g["quality"])
+    assert _scan_filename(filename) == expected
+
+
+def test_parse_episode_returns_fresh_dicts():
+    first = parse_episode("[SubsPlease] Show - 01 [1080p].mkv", path="/a")
+    second = parse_episode("[SubsPlease] Show - 01 [1080p].mkv", path="/b")
+    assert first is not second
+    assert first["path"] == "/a"
+    assert second["path"] == "/b"
+    assert {**first, "path": "/b"} == second
+
+
 # build_library tests (with mocked filesystem)
 
 @pytest.fixture
@@ -146,6 +177,121 @@ def test_build_library_with_files(mock_anime_settings):
     assert len(library["Frieren"]["episodes"]) == 2
 
 
+def test_get_disk_files_lists_top_level_videos(mock_anime_settings):
+    temp_dir = mock_anime_settings
+    main = temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv"
+    stalled = temp_dir / "stalled" / "[SubsPlease] Dropped - 01 [1080p].mkv"
+    main.touch()
+    stalled.touch()
+    (temp_dir / "notes.mkv").touch()
+    (temp_dir / "[SubsPlease] Folder - 01 [1080p].mkv.d").mkdir()
+    (temp_dir / "[SubsPlease] Dir - 01 [1080p].mkv").mkdir()
+    (temp_dir / "nested").mkdir()
+    (temp_dir / "nested" / "[SubsPlease] Nested - 01 [1080p].mkv").touch()
+
+    from local_mcp.lib.anime import _get_disk_files
+    assert _get_disk_files() == {main, stalled}
+
+
+def test_get_disk_files_reuses_listing_of_unchanged_dirs(mock_anime_settings):
+    import importlib
+    import os
+    temp_dir = mock_anime_settings
+    first = temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv"
+    first.touch()
+    for d in (temp_dir, temp_dir / "stalled"):
+        os.utime(d, (1_000_000, 1_000_000))
+
+    anime = importlib.import_module("local_mcp.lib.anime")
+    scans = []
+    real_scan = anime._scan_videos
+
+    def counting_scan(directory):
+        scans.append(directory)
+        return real_scan(directory)
+
+    with patch.object(anime, "_scan_videos", counting_scan):
+        assert anime._get_disk_files() == {first}
+        assert anime._get_disk_files() == {first}
+        assert len(scans) == 2  # one listing of each directory
+
+        # A new file bumps the directory mtime, and freshly changed
+        # directories aren't cached, so both calls list again
+        second = temp_dir / "[SubsPlease] Frieren - 02 [1080p].mkv"
+        second.touch()
+        assert anime._get_disk_files() == {first, second}
+        assert anime._get_disk_files() == {first, second}
+        assert len(scans) == 6
+
+
+def test_build_library_reused_until_history_or_disk_changes(mock_anime_settings):
+    import importlib
+    import os
+    temp_dir = mock_anime_settings
+    episode = temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv"
+    episode.touch()
+    anime = importlib.import_module("local_mcp.lib.anime")
+    anime.build_library()  # records the file, creating the lock file
+    for d in (temp_dir, temp_dir / "stalled"):
+        os.utime(d, (1_000_000, 1_000_000))
+
+    library = anime._build_library_with_history()[0]
+    assert anime._build_library_with_history()[0] is library
+
+    # Ratings go on copies, never into the shared library
+    assert anime.get_library()["series"][0]["rating"] is None
+    assert "rating" not in library["Frieren"]
+
+    anime.mark_episode(str(episode), "watched")
+    updated = anime._build_library_with_history()[0]
+    assert updated is not library
+    assert updated["Frieren"]["episodes"][0]["status"] == "watched"
+    assert library["Frieren"]["episodes"][0]["status"] == "unwatched"
+
+
+def test_library_results_can_be_modified_without_touching_cache(mock_anime_settings):
+    import importlib
+    import os
+    temp_dir = mock_anime_settings
+    (temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv").touch()
+    anime = importlib.import_module("local_mcp.lib.anime")
+    anime.build_library()
+    for d in (temp_dir, temp_dir / "stalled"):
+        os.utime(d, (1_000_000, 1_000_000))
+
+    library = anime.build_library()
+    library["Frieren"]["episodes"][0]["status"] = "watched"
+    library["Frieren"]["episodes"].clear()
+    del library["Frieren"]
+    series = anime.get_library(series="Frieren")["series"][0]
+    series["episodes"][0]["status"] = "stalled"
+    series["episodes"].append({"episode": 2.0})
+
+    assert anime.build_library()["Frieren"]["episodes"] == [
+        {"episode": 1.0, "path": str(temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv"),
+         "status": "unwatched"}
+    ]
+    assert anime.get_library(series="Frieren")["series"][0]["episodes"][0]["status"] == "unwatched"
+
+
+def test_sync_history_records_new_files_once(mock_anime_settings):
+    import json
+    temp_dir = mock_anime_settings
+    (temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv").touch()
+    (temp_dir / "stalled" / "[SubsPlease] Dropped - 01 [1080p].mkv").touch()
+
+    from local_mcp.lib.anime import build_library
+    build_library()
+    build_library()
+
+    history = temp_dir / ".anime_history"
+    entries = [json.loads(line) for line in history.read_text().splitlines()]
+    assert sorted((e["series"], e["status"]) for e in entries) == [
+        ("Dropped", "stalled"),
+        ("Frieren", "unwatched"),
+    ]
+
+
 def test_build_library_multiple_series(mock_anime_settings):
     temp_dir = mock_anime_settings
     (temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv").touch()
@@ -190,6 +336,101 @@ def test_build_library_watched_episodes_jsonl_format(mock_anime_settings):
     assert library["Watched Show"]["latest_watched"] == 1.0
 
 
+def test_mark_episode_stalled_keeps_file_already_in_stalled_dir(mock_anime_settings):
+    temp_dir = mock_anime_settings
+    sibling = temp_dir / "stalled-old" / "[SubsPlease] Other - 01 [1080p].mkv"
+    sibling.parent.mkdir()
+    episode = temp_dir / "stalled" / "[SubsPlease] Dropped - 01 [1080p].mkv"
+    episode.touch()
+
+    from local_mcp.lib.anime import _in_stalled_dir, mark_episode
+    assert _in_stalled_dir(episode)
+    assert not _in_stalled_dir(sibling)
+    assert not _in_stalled_dir(temp_dir / "stalled")
+
+    result = mark_episode(str(episode), "stalled")
+    assert result == {"status": "stalled", "path": str(episode)}
+    assert episode.exists()
+
+
+def test_history_compacted_on_write_not_read(mock_anime_settings, monkeypatch):
+    import json
+    temp_dir = mock_anime_settings
+    first = temp_dir / "[SubsPlease] Show - 01 [1080p].mkv"
+    second = temp_dir / "[SubsPlease] Show - 02 [1080p].mkv"
+    first.touch()
+    second.touch()
+
+    def entry(path, status, day, episode):
+        return {"ts": f"2024-01-{day:02d}T00:00:00+00:00", "status": status,
+                "path": str(path), "series": "Show", "episode": episode}
+
+    lines = [entry(first, "unwatched", 1, 1.0), entry(second, "watched", 2, 2.0)]
+    lines += [entry(first, s, 3, 1.0) for s in ["watched", "manual"] * 5]
+    history = temp_dir / ".anime_history"
+    history.write_text("".join(json.dumps(e) + "\n" for e in lines))
+
+    import importlib
+    anime = importlib.import_module("local_mcp.lib.anime")
+    monkeypatch.setattr(anime, "HISTORY_COMPACT_MIN_ENTRIES", 10)
+    anime.build_library()
+    assert len(history.read_text().splitlines()) == len(lines)
+
+    lines.append(entry(second, "stalled", 4, 2.0))
+    anime.write_history_entry(lines[-1])
+    before = anime._history_views(lines)
+
+    kept = [json.loads(line) for line in history.read_text().splitlines()]
+    # Latest entry per file, plus the entry holding the highest watched episode
+    assert kept == [lines[1], lines[-2], lines[-1]]
+    assert anime._history_views(anime._load_history_file()) == before
+    assert anime.build_library()["Show"]["latest_watched"] == 2.0
+
+
+def test_compaction_keeps_newest_entry_when_out_of_time_order(mock_anime_settings, monkeypatch):
+    import json
+    temp_dir = mock_anime_settings
+    path = temp_dir / "[SubsPlease] Show - 01 [1080p].mkv"
+    path.touch()
+
+    def entry(status, day):
+        return {"ts": f"2024-01-{day:02d}T00:00:00+00:00", "status": status,
+                "path": str(path), "series": "Show", "episode": 1.0}
+
+    # The newest entry by time was appended before older ones
+    lines = [entry("manual", 1), entry("stalled", 9)]
+    lines += [entry(s, 2) for s in ["manual", "unwatched"] * 5]
+    history = temp_dir / ".anime_history"
+    history.write_text("".join(json.dumps(e) + "\n" for e in lines[:-1]))
+
+    import importlib
+    anime = importlib.import_module("local_mcp.lib.anime")
+    monkeypatch.setattr(anime, "HISTORY_COMPACT_MIN_ENTRIES", 10)
+    anime.write_history_entry(lines[-1])
+    before = anime._history_views(lines)
+
+    kept = [json.loads(line) for line in history.read_text().splitlines()]
+    assert kept == [lines[1], lines[-1]]
+    assert anime._history_views(anime._load_history_file()) == before
+
+
+def test_history_lock_reuses_descriptor(mock_anime_settings):
+    import importlib
+    temp_dir = mock_anime_settings
+    anime = importlib.import_module("local_mcp.lib.anime")
+
+    with anime._history_lock():
+        fd = anime._LOCK_FD[1]
+    with anime._history_lock():
+        assert anime._LOCK_FD[1] == fd
+
+    # A removed lock file is recreated rather than locking a dead inode
+    (temp_dir / ".anime_history.lock").unlink()
+    with anime._history_lock():
+        assert (temp_dir / ".anime_history.lock").exists()
+    anime._close_lock_fd()
+
+
 def test_write_history_entry_creates_jsonl(mock_anime_settings):
     """Test that write_history_entry creates valid JSONL."""
     import json
@@ -205,6 +446,153 @@ def test_write_history_entry_creates_jsonl(mock_anime_settings):
     assert entry["series"] == "Test"
 
 
+def test_load_history_file_skips_blank_and_malformed_lines(mock_anime_settings):
+    import json
+    temp_dir = mock_anime_settings
+    history = temp_dir / ".anime_history"
+    first = {"status": "watched", "path": "/a.mkv"}
+    second = {"status": "stalled", "path": "/b.mkv"}
+    history.write_text(f"{json.dumps(first)}\n\n{{not json\n{json.dumps(second)}")
+
+    from local_mcp.lib.anime import _load_history_file
+    assert _load_history_file() == [first, second]
+
+
+def test_load_history_file_cached_until_file_changes(mock_anime_settings):
+    import json
+    temp_dir = mock_anime_settings
+    history = temp_dir / ".anime_history"
+    history.write_text(json.dumps({"status": "watched", "path": "/a.mkv"}) + "\n")
+
+    from local_mcp.lib.anime import _load_history_file, write_history_entry
+    first = _load_history_file()
+    assert _load_history_file() is first
+
+    # Appends (ours or another process's) only parse the new lines
+    write_history_entry({"status": "stalled", "path": "/b.mkv"})
+    with history.open("a") as f:
+        f.write(json.dumps({"status": "watched", "path": "/c.mkv"}) + "\n")
+    assert _load_history_file() is first
+    assert [e["path"] for e in first] == ["/a.mkv", "/b.mkv", "/c.mkv"]
+
+    # In-place rewrites are picked up, even when the file grows
+    rewritten = [{"status": "manual", "path": f"/rewritten-{i}.mkv"} for i in range(5)]
+    history.write_text("".join(json.dumps(e) + "\n" for e in rewritten))
+    assert _load_history_file() == rewritten
+
+
+def test_load_history_file_waits_for_torn_append(mock_anime_settings, caplog):
+    import json
+    temp_dir = mock_anime_settings
+    history = temp_dir / ".anime_history"
+    first = {"status": "watched", "path": "/a.mkv"}
+    second = {"status": "stalled", "path": "/b.mkv"}
+    line = json.dumps(second) + "\n"
+    history.write_text(json.dumps(first) + "\n" + line[:10])
+
+    from local_mcp.lib.anime import _load_history_file
+    assert _load_history_file() == [first]
+    assert not caplog.records
+
+    # The rest of the append lands; the entry is read, not lost
+    with history.open("a") as f:
+        f.write(line[10:] + "{not json\n")
+    assert _load_history_file() == [first, second]
+    # Line numbers count from the start of the file, not the resume offset
+    assert "line 3" in caplog.records[-1].getMessage()
+
+
+@pytest.mark.parametrize("path", [
+    "/media/data/Unsorted/[SubsPlease] Show - 01 [1080p].mkv",
+    "stalled/[SubsPlease] Show - 01 [1080p].mkv",
+    "[SubsPlease] Show - 01 [1080p].mkv",
+])
+def test_basename_matches_path_name(path):
+    from local_mcp.lib.anime import _basename
+    assert _basename(path) == Path(path).name
+
+
+def test_history_views_single_pass():
+    from local_mcp.lib.anime import _history_views
+
+    history = [
+        {"ts": "2024-01-01T00:00:00+00:00", "status": "watched", "path": "/x/a - 01.mkv",
+         "series": "A", "episode": 1.0},
+        {"ts": "2024-01-03T00:00:00+00:00", "status": "watched", "path": "/x/a - 02.mkv",
+         "series": "A", "episode": 2.0},
+        {"ts": "2024-01-02T00:00:00+00:00", "status": "stalled", "path": "/x/a - 01.mkv",
+         "series": "A", "episode": 1.0},
+    ]
+    status_by_filename, watched, series_ts = _history_views(history)
+
+    assert status_by_filename == {"a - 01.mkv": "stalled", "a - 02.mkv": "watched"}
+    assert watched == {"A": 2.0}
+    assert series_ts == {"A": "2024-01-03T00:00:00+00:00"}
+    assert _history_views(history)[0] is status_by_filename
+
+    # Growing the same list applies just the new entries
+    history.append({"ts": "2024-01-05T00:00:00+00:00", "status": "watched",
+                    "path": "/x/a - 03.mkv", "series": "A", "episode": 3.0})
+    assert _history_views(history) == _history_views(list(history))
+    assert watched == {"A": 3.0}
+
+
+@pytest.mark.parametrize("query,target,expected", [
+    ("frieren", "Sousou no Frieren", True),
+    ("no frieren", "Sousou no Frieren", True),
+    ("frieren sousou", "Sousou no Frieren", True),
+    ("frieren 2", "Sousou no Frieren", False),
+])
+def test_fuzzy_matcher(query, target, expected):
+    from local_mcp.lib.anime import _fuzzy_match, _fuzzy_matcher
+    assert _fuzzy_matcher(query)(target) is expected
+    assert _fuzzy_match(query, target) is expected
+
+
+@pytest.mark.parametrize("ts,expected", [
+    ("2024-01-03T00:00:00+00:00", "2024-01-03T00:00:00+00:00"),
+    ("2024-01-03T00:00:00Z", "2024-01-03T00:00:00+00:00"),
+    ("2024-01-03T02:00:00+02:00", "2024-01-03T00:00:00+00:00"),
+    ("2024-01-03", "2024-01-03T00:00:00+00:00"),
+    # Non-canonical UTC strings don't compare as strings until normalised
+    ("2024-01-03 12:00:00+00:00", "2024-01-03T12:00:00+00:00"),
+    ("2024-01-03T12:00+00:00", "2024-01-03T12:00:00+00:00"),
+    ("not a date", None),
+    (None, None),
+])
+def test_utc_iso(ts, expected):
+    from local_mcp.lib.anime import _utc_iso
+    assert _utc_iso(ts) == expected
+
+
+def test_get_library_filter_since(mock_anime_settings):
+    import json
+    temp_dir = mock_anime_settings
+    old_ep = temp_dir / "[SubsPlease] Old Show - 01 [1080p].mkv"
+    new_ep = temp_dir / "[SubsPlease] New Show - 01 [1080p].mkv"
+    old_ep.touch()
+    new_ep.touch()
+
+    history = temp_dir / ".anime_history"
+    history.write_text(
+        json.dumps({"ts": "2024-01-01T00:00:00+00:00", "status": "watched",
+                    "path": str(old_ep), "series": "Old Show", "episode": 1.0}) + "\n"
+        + json.dumps({"ts": "2024-06-01T12:30:00.5+00:00", "status": "watched",
+                      "path": str(new_ep), "series": "New Show", "episode": 1.0}) + "\n"
+    )
+
+    from local_mcp.lib.anime import get_library
+    titles = [s["title"] for s in get_library(since="2024-03-01")["series"]]
+    assert titles == ["New Show"]
+    titles = [s["title"] for s in get_library(before="2024-03-01T00:00:00Z")["series"]]
+    assert titles == ["Old Show"]
+    # Caller times with a space separator are compared chronologically too
+    titles = [s["title"] for s in get_library(since="2024-01-01 12:00:00+00:00")["series"]]
+    assert titles == ["New Show"]
+    titles = [s["title"] for s in get_library(before="2024-01-01 10:00:00+00:00")["series"]]
+    assert titles == ["Old Show"]
+
+
 def test_build_library_manual_episodes(mock_anime_settings):
     """Test that manual episodes are detected from history."""
     import json
@@ -281,6 +669,47 @@ def test_get_library_filter_manual(mock_anime_settings):
     assert result["series"][0]["title"] == "Manual Show"
 
 
+@pytest.mark.parametrize("filters,expected", [
+    ({}, ["Dandadan", "Frieren", "Frieren Extra"]),
+    ({"search": "frieren"}, ["Frieren", "Frieren Extra"]),
+    ({"search": "frieren", "group": "erai"}, ["Frieren Extra"]),
+    ({"min_episode": 5}, ["Dandadan", "Frieren"]),
+    ({"max_episode": 3}, ["Frieren", "Frieren Extra"]),
+    ({"min_episode": 5, "max_episode": 3}, ["Frieren"]),
+    ({"status": "unwatched", "group": "subs"}, ["Dandadan", "Frieren"]),
+])
+def test_get_library_combined_filters(mock_anime_settings, filters, expected):
+    temp_dir = mock_anime_settings
+    for name in [
+        "[SubsPlease] Frieren - 01 [1080p].mkv",
+        "[SubsPlease] Frieren - 06 [1080p].mkv",
+        "[SubsPlease] Dandadan - 05 [1080p].mkv",
+        "[Erai-raws] Frieren Extra - 02 [1080p].mkv",
+    ]:
+        (temp_dir / name).touch()
+
+    from local_mcp.lib.anime import get_library
+    assert [s["title"] for s in get_library(**filters)["series"]] == expected
+
+
+def test_get_library_filter_watched_needs_every_episode(mock_anime_settings):
+    import json
+    temp_dir = mock_anime_settings
+    done = temp_dir / "[SubsPlease] Done - 01 [1080p].mkv"
+    half = temp_dir / "[SubsPlease] Half - 01 [1080p].mkv"
+    for f in (done, half, temp_dir / "[SubsPlease] Half - 02 [1080p].mkv"):
+        f.touch()
+    (temp_dir / ".anime_history").write_text("".join(
+        json.dumps({"status": "watched", "path": str(f), "series": series, "episode": 1.0})
+        + "\n"
+        for f, series in [(done, "Done"), (half, "Half")]
+    ))
+
+    from local_mcp.lib.anime import get_library
+    assert [s["title"] for s in get_library(status="watched")["series"]] == ["Done"]
+    assert [s["title"] for s in get_library(status="unwatched")["series"]] == ["Half"]
+
+
 # Path traversal guard
 
 @pytest.mark.parametrize("evil", [
@@ -317,3 +746,72 @@ def test_mark_episode_still_accepts_paths_inside_base(temp_dir):
     ):
         result = anime.mark_episode(str(f), "watched")
         assert result.get("status") == "watched"
+
+
+# check_trusted_releases
+
+
+@pytest.mark.asyncio
+async def test_check_trusted_releases_merges_groups_in_priority_order(mock_anime_settings):
+    import importlib
+    temp_dir = mock_anime_settings
+    (temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv").touch()
+
+    anime = importlib.import_module("local_mcp.lib.anime")
+    first, second, broken = "SubsPlease", "Erai-raws", "Broken"
+
+    async def fake_fetch(group, client=None):
+        assert client is not None
+        if group == broken:
+            raise RuntimeError("boom")
+        return [
+            {"title": "Frieren", "episode": 2.0, "group": group, "quality": "1080p"},
+            {"title": "Frieren", "episode": 1.0, "group": group, "quality": "1080p"},
+            {"title": "Untracked", "episode": 1.0, "group": group, "quality": "1080p"},
+        ]
+
+    with patch.object(anime, "TRUSTED_GROUPS", [broken, first, second]), \
+            patch.object(anime.torrent, "fetch_group_releases", fake_fetch):
+        result = await anime.check_trusted_releases()
+
+    assert result["matched_series"] == 1
+    assert [(e["series"], e["episode"], e["group"]) for e in result["available"]] == [
+        ("Frieren", 2.0, first)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_check_trusted_releases_downloads_concurrently(mock_anime_settings):
+    import importlib
+    import json
+    temp_dir = mock_anime_settings
+    (temp_dir / "[SubsPlease] Frieren - 01 [1080p].mkv").touch()
+
+    anime = importlib.import_module("local_mcp.lib.anime")
+    releases = [
+        {"title": "Frieren", "episode": float(n), "group": "SubsPlease",
+         "quality": "1080p", "torrent": f"https://nyaa.si/download/{n}.torrent"}
+        for n in (2, 3)
+    ]
+
+    async def fake_fetch(group, client=None):
+        return releases
+
+    async def fake_download(url, client=None):
+        assert client is not None
+        if url.endswith("/3.torrent"):
+            raise RuntimeError("boom")
+        return temp_dir / ".watch" / "start" / url.rpartition("/")[2]
+
+    with patch.object(anime, "TRUSTED_GROUPS", ["SubsPlease"]), \
+            patch.object(anime.torrent, "fetch_group_releases", fake_fetch), \
+            patch.object(anime.torrent, "download_async", fake_download), \
+            patch.object(anime.torrent, "video_path", lambda dest: f"/videos/{dest.stem}.mkv"):
+        result = await anime.check_trusted_releases(download=True)
+
+    assert [e["episode"] for e in result["available"]] == [2.0, 3.0]
+    assert [e["episode"] for e in result["downloaded"]] == [2.0]
+    history = [json.loads(line) for line in (temp_dir / ".anime_history").read_text().splitlines()]
+    assert [(e["path"], e["status"]) for e in history if e["path"].startswith("/videos/")] == [
+        ("/videos/2.mkv", "unwatched")
+    ]
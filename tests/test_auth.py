@@ -74,7 +74,31 @@ def test_generate_token_uniqueness(auth_instance):
     assert len(tokens) == 100  # All unique
 
 
-def test_verify_credentials_with_valid_credentials(temp_dir, monkeypatch):
+def test_generate_token_pair(auth_instance):
+    access, refresh = auth_instance._generate_token_pair()
+    assert access.startswith("at_")
+    assert refresh.startswith("rt_")
+    assert access[3:] != refresh[3:]
+    assert len(access) == len(auth_instance._generate_token("at_"))
+
+
+def test_create_tokens_mints_again_on_key_collision(auth_instance):
+    from local_mcp.token_db import token_key
+
+    taken = auth_instance._create_tokens("u", "c", [])
+    same_key = f"{token_key(taken[0])}.other"
+    pairs = iter([(same_key, "rt_fresh.1"), ("at_fresh.2", "rt_fresh.2")])
+    auth_instance._generate_token_pair = lambda: next(pairs)
+
+    # The first pair reuses the live access token's key, so it is not stored
+    assert auth_instance._create_tokens("u", "c", []) == ("at_fresh.2", "rt_fresh.2")
+    assert auth_instance._db.get_refresh_token("rt_fresh.1") is None
+    assert auth_instance._db.get_token(taken[0]) is not None
+
+
+@pytest.fixture
+def fresh_auth(temp_dir, monkeypatch):
+    """Freshly imported auth module, with an htpasswd file holding testuser."""
     import sys
 
     for mod in list(sys.modules.keys()):
@@ -88,19 +112,145 @@ def test_verify_credentials_with_valid_credentials(temp_dir, monkeypatch):
     htpasswd.set_password("testuser", "testpass")
     htpasswd.save()
 
-    token_db_path = temp_dir / ".token_db.json"
     monkeypatch.setenv("LOCAL_MCP_HTPASSWD", str(htpasswd_path))
-    monkeypatch.setenv("LOCAL_MCP_TOKEN_DB", str(token_db_path))
+    monkeypatch.setenv("LOCAL_MCP_TOKEN_DB", str(temp_dir / ".token_db.json"))
     monkeypatch.setenv("LOCAL_MCP_BASE_URL", "http://localhost:3000")
 
-    from local_mcp.auth import HtpasswdAuth
+    from local_mcp import auth
+
+    yield auth, htpasswd
+
+
+def _new_auth(auth_module, temp_dir):
     from local_mcp.token_db import TokenDB
 
-    auth = HtpasswdAuth(db=TokenDB(token_db_path))
+    return auth_module.HtpasswdAuth(db=TokenDB(temp_dir / ".token_db.json"))
+
+
+@pytest.mark.asyncio
+async def test_verify_credentials_with_valid_credentials(fresh_auth, temp_dir):
+    auth = _new_auth(fresh_auth[0], temp_dir)
+
+    assert await auth._verify_credentials("testuser", "testpass") is True
+    assert not await auth._verify_credentials("testuser", "wrongpass")
+    assert not await auth._verify_credentials("wronguser", "testpass")
+
+
+@pytest.mark.asyncio
+async def test_verify_credentials_picks_up_htpasswd_changes(fresh_auth, temp_dir):
+    auth_module, htpasswd = fresh_auth
+    auth = _new_auth(auth_module, temp_dir)
+    assert not await auth._verify_credentials("newuser", "newpass")
+
+    htpasswd.set_password("newuser", "newpass")
+    htpasswd.save()
+
+    assert await auth._verify_credentials("newuser", "newpass") is True
+
+
+@pytest.mark.asyncio
+async def test_verify_credentials_caches_result(fresh_auth, temp_dir, monkeypatch):
+    from passlib.apache import HtpasswdFile
+
+    auth = _new_auth(fresh_auth[0], temp_dir)
+    assert await auth._verify_credentials("testuser", "testpass") is True
+
+    def fail(*args, **kwargs):
+        raise AssertionError("check_password should not be called on a cache hit")
+
+    monkeypatch.setattr(HtpasswdFile, "check_password", fail)
+    assert await auth._verify_credentials("testuser", "testpass") is True
+
+
+def test_htpasswd_parsed_on_init(fresh_auth, temp_dir):
+    auth_module = fresh_auth[0]
+    assert auth_module._HTPASSWD_CACHE is None
+    _new_auth(auth_module, temp_dir)
+    assert auth_module._HTPASSWD_CACHE is not None
+
+
+def test_login_page_renders_error_and_pending(auth_instance):
+    body = auth_instance._login_page("pending_abc", "Bad <input>").body.decode()
+    assert '<div class="error">Bad &lt;input&gt;</div>' in body
+    assert '<input type="hidden" name="pending" value="pending_abc">' in body
+    assert "$" not in body
+
+
+def test_login_page_without_error_or_pending(auth_instance):
+    body = auth_instance._login_page("").body.decode()
+    assert 'class="error">' not in body
+    assert 'name="pending"' not in body
+    assert "$" not in body
+
+
+def test_login_get_without_pending_serves_prerendered_page(auth_instance):
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from local_mcp.auth import _EMPTY_LOGIN_PAGE
+
+    app = Starlette(routes=[Route("/login", auth_instance._handle_login, methods=["GET", "POST"])])
+    client = TestClient(app)
+    for _ in range(2):
+        response = client.get("/login")
+        assert response.status_code == 200
+        assert response.content == _EMPTY_LOGIN_PAGE
+    # a fresh response each time, so one request's headers never leak into another's
+    first = auth_instance._login_page("")
+    first.set_cookie("session", "abc")
+    assert "set-cookie" not in auth_instance._login_page("").headers
+
+
+@pytest.mark.parametrize(
+    "pending_id,expected",
+    [
+        ("pending_abc.DEF-123", "pending_abc.DEF-123"),
+        ("", ""),
+        ('"><script>alert(1)</script>', ""),
+        ("pending_abc&x=1", ""),
+    ],
+)
+def test_clean_pending_id(auth_instance, pending_id, expected):
+    assert auth_instance._clean_pending_id(pending_id) == expected
+
+
+@pytest.mark.parametrize(
+    "redirect_uri,state,expected_prefix,expected_suffix",
+    [
+        ("http://localhost/cb", None, "http://localhost/cb?code=code_", ""),
+        ("http://localhost/cb?x=1", "a b&c", "http://localhost/cb?x=1&code=code_", "&state=a+b%26c"),
+    ],
+)
+def test_login_redirects_with_code(
+    auth_instance, temp_dir, redirect_uri, state, expected_prefix, expected_suffix
+):
+    from passlib.apache import HtpasswdFile
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+    from starlette.testclient import TestClient
+
+    from local_mcp.token_db import PendingAuth
+
+    htpasswd = HtpasswdFile(str(temp_dir / ".htpasswd"), new=True)
+    htpasswd.set_password("testuser", "testpass")
+    htpasswd.save()
+    auth_instance._db.set_pending_auth(
+        "pending_abc",
+        PendingAuth("c", redirect_uri, [], state, None, time.time() + 600),
+    )
+
+    app = Starlette(routes=[Route("/login", auth_instance._handle_login, methods=["GET", "POST"])])
+    response = TestClient(app).post(
+        "/login",
+        data={"username": "testuser", "password": "testpass", "pending": "pending_abc"},
+        follow_redirects=False,
+    )
 
-    assert auth._verify_credentials("testuser", "testpass") is True
-    assert not auth._verify_credentials("testuser", "wrongpass")
-    assert not auth._verify_credentials("wronguser", "testpass")
+    assert response.status_code == 302
+    location = response.headers["location"]
+    assert location.startswith(expected_prefix)
+    assert location.endswith(expected_suffix)
 
 
 def test_cleanup_expired_removes_old_tokens(auth_instance):
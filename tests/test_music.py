@@ -1,5 +1,7 @@
 """Tests for music/MPD library."""
 
+from operator import itemgetter
+
 import pytest
 
 from local_mcp.lib.music import (
@@ -70,6 +72,21 @@ def test_parse_list_response(lines, expected):
     assert parse_list_response(lines) == expected
 
 
+def test_parse_list_response_keeps_only_requested_tags():
+    lines = [
+        "directory: Artist",
+        "Last-Modified: 2024-01-01T00:00:00Z",
+        "file: Artist/track.mp3",
+        "Artist: Someone",
+        "Title: Track",
+        "Time: 180",
+    ]
+    assert parse_list_response(lines, keys=frozenset({"Title", "Time"})) == [
+        {"directory": "Artist"},
+        {"file": "Artist/track.mp3", "Title": "Track", "Time": "180"},
+    ]
+
+
 # _should_skip tests
 
 @pytest.mark.parametrize("path,patterns,expected", [
@@ -87,6 +104,11 @@ def test_parse_list_response(lines, expected):
     # Case sensitivity
     ("Music/AUDIOBOOKS/track.mp3", ["audiobooks"], False),  # Default is case-sensitive
     ("Music/AUDIOBOOKS/track.mp3", ["(?i)audiobooks"], True),  # Case-insensitive regex
+    # Inline flags apply to their own pattern only
+    ("Music/AUDIOBOOKS/track.mp3", ["Dresden", "(?i)audiobooks"], True),
+    ("Music/DRESDEN/track.mp3", ["(?i)audiobooks", "Dresden"], False),
+    # Patterns that can't share one regex are still matched one by one
+    ("Music/b.mp3", [r"(?P<x>a)\.mp3", r"(?P<x>b)\.mp3"], True),
 ])
 def test_should_skip(path, patterns, expected):
     assert _should_skip(path, patterns) == expected
@@ -107,3 +129,301 @@ def test_should_skip_matches(path, patterns):
 ])
 def test_should_skip_no_match(path, patterns):
     assert _should_skip(path, patterns) is False
+
+
+# _get_all_files_listall tests
+
+# lsinfo responses of a small library, by directory
+MPD_TREE = {
+    "": ["directory: Music", "directory: Audiobooks", "file: loose.mp3"],
+    "Music": ["directory: Music/Files", "file: Music/a.mp3", "Title: A", "Time: 100"],
+    "Music/Files": ["file: Music/Files/b.mp3"],
+    "Audiobooks": ["file: Audiobooks/c.mp3"],
+}
+
+
+async def _fake_mpd_command(reader, writer, cmd):
+    if cmd.startswith("listallinfo"):
+        # Every directory and song under the path, in one response
+        base = cmd.partition(" ")[2].strip('"')
+        return [
+            line
+            for path, lines in MPD_TREE.items()
+            if path == base or path.startswith(f"{base}/") or not base
+            for line in lines
+        ]
+    return MPD_TREE[cmd.partition(" ")[2].strip('"')]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path,patterns", [
+    ("", []),
+    ("", ["Files$"]),  # matches the directory, but none of the files under it
+    ("", ["^Audiobooks", "loose"]),
+    ("Music", []),
+    ("Audiobooks", ["^Audiobooks"]),
+])
+async def test_listall_matches_recursive_walk(monkeypatch, path, patterns):
+    from local_mcp.lib import music
+    monkeypatch.setattr(music, "mpd_command", _fake_mpd_command)
+
+    listed = await music._get_all_files_listall(None, None, path, patterns)
+    walked = await music._get_all_files_recursive(None, None, path, patterns)
+    by_file = itemgetter("file")
+    assert sorted(listed, key=by_file) == sorted(walked, key=by_file)
+
+
+# mpd_command tests
+
+class _FakeWriter:
+    def __init__(self):
+        self.sent = b""
+        self.closed = False
+
+    def write(self, data):
+        self.sent += data
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def _reader(*chunks: bytes, eof: bool = False):
+    import asyncio
+    reader = asyncio.StreamReader()
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunks,expected", [
+    ([b"OK\n"], []),
+    ([b"volume: 100\nstate: play\nOK\n"], ["volume: 100", "state: play"]),
+    # A response split mid-line, and a value that merely ends in OK
+    ([b"file: a.mp3\nTit", b"le: OK\n", b"OK\n"], ["file: a.mp3", "Title: OK"]),
+    ([b"Title: caf\xc3", b"\xa9\nOK\n"], ["Title: café"]),
+])
+@pytest.mark.parametrize("read_size", [3, 64 * 1024])
+async def test_mpd_command_reads_until_ok(monkeypatch, chunks, expected, read_size):
+    from local_mcp.lib import music
+    monkeypatch.setattr(music, "_READ_CHUNK", read_size)
+    writer = _FakeWriter()
+    assert await music.mpd_command(_reader(*chunks), writer, "status") == expected
+    assert writer.sent == b"status\n"
+
+
+@pytest.mark.asyncio
+async def test_mpd_command_raises_on_ack_and_close():
+    from local_mcp.lib.music import MPDError, mpd_command
+    with pytest.raises(MPDError, match=r"ACK \[50@0\] \{lsinfo\} No such directory"):
+        await mpd_command(
+            _reader(b"ACK [50@0] {lsinfo} No such directory\n"), _FakeWriter(), "lsinfo x"
+        )
+    with pytest.raises(MPDError, match="Connection closed"):
+        await mpd_command(_reader(b"volume: 1\n", eof=True), _FakeWriter(), "status")
+
+
+@pytest.mark.asyncio
+async def test_mpd_command_list_splits_responses():
+    from local_mcp.lib.music import mpd_command_list
+    writer = _FakeWriter()
+    reader = _reader(b"list_OK\nvolume: 50\nlist_OK\nlist_OK\nOK\n")
+    assert await mpd_command_list(reader, writer, ["play", "status", "currentsong"]) == [
+        [], ["volume: 50"], []
+    ]
+    assert writer.sent == (
+        b"command_list_ok_begin\nplay\nstatus\ncurrentsong\ncommand_list_end\n"
+    )
+
+
+# connection pool tests
+
+@pytest.fixture
+def fake_mpd_server(monkeypatch, request):
+    """Record the connections opened to a fake MPD, which answers OK to all.
+
+    A connection whose fails_after is set stops answering after that many
+    commands, as the fixture's param ("eof" or "reset") says. MPD closed or
+    reset it; that is only seen once the next command has been sent.
+    """
+    import asyncio
+    from local_mcp.lib import music
+    failure = getattr(request, "param", "eof")
+    writers = []
+
+    class Writer(_FakeWriter):
+        fails_after = None
+
+        def write(self, data):
+            super().write(data)
+            if self.fails_after is not None and self.sent.count(b"\n") > self.fails_after:
+                if failure == "reset":
+                    self.reader.set_exception(ConnectionResetError("Connection reset by peer"))
+                else:
+                    self.reader.feed_eof()
+            else:
+                self.reader.feed_data(b"OK\n")
+
+    async def open_connection(host, port):
+        writers.append(Writer())
+        writers[-1].reader = _reader(b"OK MPD 0.23.5\n")
+        return writers[-1].reader, writers[-1]
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+    monkeypatch.setattr(music, "_POOL", None)
+    return writers
+
+
+@pytest.mark.asyncio
+async def test_mpd_connection_is_reused(fake_mpd_server):
+    from local_mcp.lib.music import mpd_command, mpd_connection
+    for cmd in ("status", "currentsong"):
+        async with mpd_connection() as (reader, writer):
+            await mpd_command(reader, writer, cmd)
+    assert [w.sent for w in fake_mpd_server] == [b"status\ncurrentsong\n"]
+
+
+@pytest.mark.asyncio
+async def test_mpd_connection_replaced_after_error_or_idling(monkeypatch, fake_mpd_server):
+    from local_mcp.lib import music
+    with pytest.raises(RuntimeError):
+        async with music.mpd_connection():
+            raise RuntimeError("half-read response")
+    async with music.mpd_connection():
+        pass
+    monkeypatch.setattr(music, "_POOL_MAX_IDLE", -1.0)
+    async with music.mpd_connection():
+        pass
+    assert [w.closed for w in fake_mpd_server] == [True, True, False]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fake_mpd_server", ["eof", "reset"], indirect=True)
+async def test_idle_pooled_connection_is_pinged_and_replaced_if_gone(
+    monkeypatch, fake_mpd_server
+):
+    from local_mcp.lib import music
+    await music.rate(3, "a.mp3")
+    fake_mpd_server[0].fails_after = 1
+    monkeypatch.setattr(music, "_POOL_PING_AFTER", -1.0)
+    assert (await music.rate(4, "b.mp3"))["rating_sticker"] == 8
+    assert len(fake_mpd_server) == 2 and fake_mpd_server[0].closed
+    assert fake_mpd_server[0].sent.endswith(b"ping\n")
+    assert fake_mpd_server[1].sent == b'sticker set song "b.mp3" rating "8"\n'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fake_mpd_server", ["eof", "reset"], indirect=True)
+async def test_connection_lost_mid_call_raises_mpd_error(fake_mpd_server):
+    from local_mcp.lib import music
+    async with music.mpd_connection() as (reader, writer):
+        await music.mpd_command(reader, writer, "status")
+    fake_mpd_server[0].fails_after = 2
+    with pytest.raises(music.MPDError, match="Connection (closed|lost)"):
+        async with music.mpd_connection() as (reader, writer):
+            await music.mpd_command(reader, writer, "next")
+            await music.mpd_command(reader, writer, "status")
+    # nothing is sent again once a command went through
+    assert len(fake_mpd_server) == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_call_does_not_hold_up_others(fake_mpd_server):
+    import asyncio
+    from local_mcp.lib import music
+    walking, done = asyncio.Event(), asyncio.Event()
+
+    async def walk():
+        async with music.mpd_connection():
+            walking.set()
+            await done.wait()
+
+    task = asyncio.create_task(walk())
+    await walking.wait()
+    async with music.mpd_connection() as (reader, writer):
+        assert await music.mpd_command(reader, writer, "status") == []
+    done.set()
+    await task
+    assert len(fake_mpd_server) == 2
+
+    # both are kept for reuse, and closed on shutdown
+    await music.close_connections()
+    assert all(w.closed for w in fake_mpd_server)
+
+
+@pytest.mark.asyncio
+async def test_mpd_command_times_out(monkeypatch):
+    from local_mcp.lib import music
+    monkeypatch.setattr(music, "_READ_TIMEOUT", 0.01)
+    with pytest.raises(music.MPDError, match="Timed out"):
+        await music.mpd_command(_reader(b"volume: 1\n"), _FakeWriter(), "status")
+
+
+@pytest.mark.asyncio
+async def test_player_command_pipelines_status(monkeypatch):
+    import asyncio
+    from local_mcp.lib import music
+    writer = _FakeWriter()
+    response = (
+        b"list_OK\nstate: stop\nvolume: 50\nlist_OK\nlist_OK\nOK\n"
+    )
+
+    async def open_connection(host, port):
+        return _reader(b"OK MPD 0.23.5\n" + response), writer
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+    monkeypatch.setattr(music, "_POOL", None)
+    assert await music.player_command([["setvol", "50"]]) == {
+        "state": "stop", "volume": "50"
+    }
+    assert writer.sent == (
+        b"command_list_ok_begin\nsetvol 50\nstatus\ncurrentsong\ncommand_list_end\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_all_files_walks_tree_on_new_connection_if_listall_drops_it(monkeypatch):
+    import asyncio
+    from local_mcp.lib import music
+    connections = []
+
+    class Writer(_FakeWriter):
+        def write(self, data):
+            super().write(data)
+            cmd = data.decode().strip()
+            if cmd.startswith("listallinfo"):
+                # MPD drops clients whose output overflows its buffer
+                self.reader.feed_data(b"directory: Music\nfile: Mus")
+                self.reader.feed_eof()
+            else:
+                lines = MPD_TREE[cmd.partition(" ")[2].strip('"')]
+                self.reader.feed_data("".join(f"{line}\n" for line in lines).encode() + b"OK\n")
+
+    async def open_connection(host, port):
+        writer = Writer()
+        writer.reader = _reader(b"OK MPD 0.23.5\n")
+        connections.append(writer)
+        return writer.reader, writer
+
+    monkeypatch.setattr(asyncio, "open_connection", open_connection)
+    monkeypatch.setattr(music, "_POOL", None)
+    monkeypatch.setattr(music, "_cache", {})
+    monkeypatch.setattr(music, "MPD_SKIP_PATTERNS", [])
+
+    files = await music.get_all_files()
+    assert sorted(f["file"] for f in files) == [
+        "Audiobooks/c.mp3", "Music/Files/b.mp3", "Music/a.mp3", "loose.mp3"
+    ]
+    assert len(connections) == 2 and connections[0].closed
+    assert connections[1].sent.startswith(b"lsinfo\n")
@@ -35,6 +35,13 @@ def test_latest_entry_wins(ratings_env):
     assert latest["Mushoku Tensei"]["rating"] is None
 
 
+def test_load_skips_blank_and_malformed_lines(ratings_env):
+    from local_mcp.lib import ratings
+    good = {"series": "Frieren", "rating": 5.0, "status": "finished"}
+    (ratings_env / ".anime_ratings").write_text(f"\n{{broken\n{json.dumps(good)}\n")
+    assert ratings.latest_ratings() == {"Frieren": good}
+
+
 def test_drop_without_rating_is_legal(ratings_env):
     from local_mcp.lib import ratings
     entry = ratings.write_rating("Hana-Kimi", None, "dropped")
@@ -1,15 +1,18 @@
-"""Tests for TokenDB JSON persistence."""
+"""Tests for TokenDB JSONL persistence."""
 
 import time
 
 import pytest
 
+from local_mcp import token_db
 from local_mcp.token_db import (
+    FLUSH_DELAY,
     PendingAuth,
     PermissiveClient,
     StoredAuthCode,
     StoredToken,
     TokenDB,
+    TokenKeyCollision,
 )
 
 
@@ -174,3 +177,292 @@ def test_db_handles_corrupted_file(temp_dir):
 
     db = TokenDB(db_path)
     assert db.get_token("anything") is None  # Starts fresh
+
+
+def test_expired_entries_evicted_on_lookup(db):
+    now = time.time()
+    db.set_token("expired", StoredToken("expired", "u", [], now - 100, "c"))
+    db.set_pending_auth(
+        "pending_expired",
+        PendingAuth("c", "http://x", [], None, None, now - 100),
+    )
+
+    assert db.get_token("expired") is None
+    assert "expired" not in db._all_tokens
+    assert db.pop_pending_auth("pending_expired") is None
+
+
+def test_token_lookup_requires_full_token(db):
+    db.set_token(
+        "at_key.secret", StoredToken("at_key.secret", "u", [], time.time() + 3600, "c")
+    )
+
+    assert db.get_token("at_key.secret") is not None
+    assert db.get_token("at_key.wrong") is None
+    assert db.get_token("at_key") is None
+
+
+def test_set_token_pair_persists_both(temp_dir):
+    db_path = temp_dir / ".token_db.json"
+    expires = time.time() + 3600
+
+    db1 = TokenDB(db_path)
+    db1.set_token_pair(
+        "at_a.1", StoredToken("at_a.1", "u", [], expires, "c"),
+        "rt_b.2", StoredToken("rt_b.2", "u", [], expires, "c"),
+    )
+
+    db2 = TokenDB(db_path)
+    assert db2.get_token("at_a.1") is not None
+    assert db2.get_refresh_token("rt_b.2") is not None
+    assert db2.get_token("rt_b.2") is None
+
+
+def test_key_collision_does_not_overwrite_live_token(db):
+    expires = time.time() + 3600
+    db.set_token("at_key.1", StoredToken("at_key.1", "u", [], expires, "c"))
+    # Re-setting the same token is not a collision
+    db.set_token("at_key.1", StoredToken("at_key.1", "u", ["read"], expires, "c"))
+
+    with pytest.raises(TokenKeyCollision):
+        db.set_token("at_key.2", StoredToken("at_key.2", "u", [], expires, "c"))
+    with pytest.raises(TokenKeyCollision):
+        db.set_token_pair(
+            "at_new.1", StoredToken("at_new.1", "u", [], expires, "c"),
+            "at_key.3", StoredToken("at_key.3", "u", [], expires, "c"),
+        )
+    assert db.get_token("at_key.1").scopes == ["read"]
+    assert db.get_token("at_new.1") is None
+
+    def code(c):
+        return StoredAuthCode(c, "c", "r", [], None, expires, "u")
+
+    db.set_auth_code("code_key.1", code("code_key.1"))
+    with pytest.raises(TokenKeyCollision):
+        db.set_auth_code("code_key.2", code("code_key.2"))
+    assert db.get_auth_code("code_key.1") is not None
+
+
+def test_expired_token_key_can_be_reused(db):
+    db.set_token("at_key.1", StoredToken("at_key.1", "u", [], time.time() - 1, "c"))
+    db.set_token("at_key.2", StoredToken("at_key.2", "u", [], time.time() + 3600, "c"))
+    assert db.get_token("at_key.2") is not None
+
+
+def test_db_loads_legacy_refresh_tokens_section(temp_dir):
+    import json
+
+    db_path = temp_dir / ".token_db.json"
+    legacy = {"token": "rt_old", "user": "u", "scopes": [],
+              "expires_at": time.time() + 3600, "client_id": "c"}
+    db_path.write_text(json.dumps({"refresh_tokens": {"rt_old": legacy}}))
+
+    db = TokenDB(db_path)
+    assert db.get_refresh_token("rt_old") is not None
+    assert db.get_token("rt_old") is None
+
+
+@pytest.mark.parametrize("redirect_uri,separator", [
+    ("http://localhost/cb", "?"),
+    ("http://localhost/cb?client=1", "&"),
+])
+def test_pending_auth_separator(redirect_uri, separator):
+    pending = PendingAuth("c", redirect_uri, [], None, None, time.time() + 600)
+    assert pending.separator == separator
+
+
+def test_auth_code_lookup_requires_full_code(db):
+    db.set_auth_code(
+        "code_key.secret",
+        StoredAuthCode("code_key.secret", "c", "http://x", [], None, time.time() + 600, "u"),
+    )
+
+    assert db.pop_auth_code("code_key.wrong") is None
+    assert db.get_auth_code("code_key.secret") is not None
+    assert db.pop_auth_code("code_key.secret") is not None
+    assert db.get_auth_code("code_key.secret") is None
+
+
+def test_cleanup_uses_expiry_of_reset_and_loaded_entries(temp_dir):
+    db_path = temp_dir / ".token_db.json"
+    now = time.time()
+
+    db1 = TokenDB(db_path)
+    db1.set_token("old", StoredToken("old", "user", [], now + 10, "c"))
+    db1.set_token("renewed", StoredToken("renewed", "user", [], now + 10, "c"))
+    db1.set_token("renewed", StoredToken("renewed", "user", [], now + 3600, "c"))
+    db1.set_token("gone", StoredToken("gone", "user", [], now + 10, "c"))
+    db1.delete_token("gone")
+
+    db1.cleanup_expired(now + 60)
+    assert db1.get_token("old", now) is None
+    assert db1.get_token("renewed", now) is not None
+
+    # A fresh instance rebuilds its schedule from the file
+    db2 = TokenDB(db_path)
+    db2.set_token("old", StoredToken("old", "user", [], now + 10, "c"))
+    db3 = TokenDB(db_path)
+    db3.cleanup_expired(now + 60)
+    assert db3.get_token("old", now) is None
+    assert db3.get_token("renewed", now) is not None
+
+
+@pytest.mark.asyncio
+async def test_mutations_in_event_loop_are_saved_together(temp_dir, monkeypatch):
+    import asyncio
+    db_path = temp_dir / ".token_db.json"
+    db = TokenDB(db_path)
+    saves = []
+    monkeypatch.setattr(db, "_save", lambda: saves.append(len(db._all_tokens)))
+
+    expires = time.time() + 3600
+    db.set_token("a", StoredToken("a", "u", [], expires, "c"))
+    db.set_token("b", StoredToken("b", "u", [], expires, "c"))
+    db.delete_token("a")
+    assert saves == []
+
+    await asyncio.sleep(FLUSH_DELAY + 0.1)
+    assert saves == [1]
+
+
+def test_changes_saved_after_flush_timer_loop_closed(temp_dir):
+    import asyncio
+    db_path = temp_dir / ".token_db.json"
+    db = TokenDB(db_path)
+    expires = time.time() + 3600
+
+    async def set_token(token, wait=0.0):
+        db.set_token(token, StoredToken(token, "u", [], expires, "c"))
+        await asyncio.sleep(wait)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(set_token("a"))
+    loop.close()  # before the flush timer fired
+
+    # a new loop schedules its own flush
+    asyncio.run(set_token("b", wait=FLUSH_DELAY + 0.1))
+    assert TokenDB(db_path).get_token("b") is not None
+    db.set_token("c", StoredToken("c", "u", [], expires, "c"))  # no loop: saved now
+    assert all(TokenDB(db_path).get_token(t) is not None for t in "abc")
+
+
+@pytest.mark.asyncio
+async def test_flush_saves_pending_changes(temp_dir):
+    db_path = temp_dir / ".token_db.json"
+    db = TokenDB(db_path)
+    db.set_token("tok", StoredToken("tok", "u", [], time.time() + 3600, "c"))
+    assert not db_path.exists()
+
+    db.flush()
+    assert TokenDB(db_path).get_token("tok") is not None
+
+
+def test_saves_append_changed_keys(temp_dir):
+    import json
+
+    db_path = temp_dir / ".token_db.json"
+    expires = time.time() + 3600
+    db = TokenDB(db_path)
+    db.set_token("a", StoredToken("a", "u", [], expires, "c"))
+    db.set_token("b", StoredToken("b", "u", [], expires, "c"))
+    db.delete_token("a")
+
+    records = [json.loads(line) for line in db_path.read_text().splitlines()]
+    assert [(r["op"], r["key"]) for r in records] == [("set", "a"), ("set", "b"), ("del", "a")]
+
+    db2 = TokenDB(db_path)
+    assert db2.get_token("a") is None
+    assert db2.get_token("b") is not None
+
+
+def test_log_compacted_when_mostly_stale(temp_dir, monkeypatch):
+    monkeypatch.setattr(token_db, "COMPACT_MIN_LINES", 5)
+    db_path = temp_dir / ".token_db.json"
+    db = TokenDB(db_path)
+    for _ in range(10):
+        db.set_token("tok", StoredToken("tok", "u", [], time.time() + 3600, "c"))
+
+    assert len(db_path.read_text().splitlines()) < 5
+    assert not db_path.with_name(db_path.name + ".tmp").exists()
+    assert TokenDB(db_path).get_token("tok") is not None
+
+
+def test_compacted_log_is_appended_to_after_reload(temp_dir, monkeypatch):
+    monkeypatch.setattr(token_db, "COMPACT_MIN_LINES", 5)
+    db_path = temp_dir / ".token_db.json"
+    expires = time.time() + 3600
+    db = TokenDB(db_path)
+    for _ in range(5):
+        db.set_token("a", StoredToken("a", "u", [], expires, "c"))
+    snapshot = db_path.read_text()
+    assert len(snapshot.splitlines()) == 1
+
+    db2 = TokenDB(db_path)
+    db2.set_token("b", StoredToken("b", "u", [], expires, "c"))
+    assert db_path.read_text().startswith(snapshot)
+    assert len(db_path.read_text().splitlines()) == 2
+
+    db3 = TokenDB(db_path)
+    assert db3.get_token("a") is not None
+    assert db3.get_token("b") is not None
+
+
+def test_single_record_log_is_appended_to(temp_dir):
+    db_path = temp_dir / ".token_db.json"
+    expires = time.time() + 3600
+    TokenDB(db_path).set_token("a", StoredToken("a", "u", [], expires, "c"))
+    first = db_path.read_text()
+
+    TokenDB(db_path).set_token("b", StoredToken("b", "u", [], expires, "c"))
+    assert db_path.read_text().startswith(first)
+    assert len(db_path.read_text().splitlines()) == 2
+
+
+def test_torn_last_line_is_skipped_and_not_appended_to(temp_dir):
+    db_path = temp_dir / ".token_db.json"
+    expires = time.time() + 3600
+    TokenDB(db_path).set_token("a", StoredToken("a", "u", [], expires, "c"))
+    with open(db_path, "a") as f:
+        f.write('{"op": "set", "table": "tokens", "ke')
+
+    db = TokenDB(db_path)
+    assert db.get_token("a") is not None
+    db.set_token("b", StoredToken("b", "u", [], expires, "c"))
+
+    db2 = TokenDB(db_path)
+    assert db2.get_token("a") is not None
+    assert db2.get_token("b") is not None
+
+
+@pytest.mark.parametrize("ending", ["", "\n"])
+def test_legacy_snapshot_file_is_rewritten_before_appending(temp_dir, ending):
+    import json
+
+    db_path = temp_dir / ".token_db.json"
+    legacy = {"token": "a", "user": "u", "scopes": [],
+              "expires_at": time.time() + 3600, "client_id": "c", "kind": "access"}
+    db_path.write_text(json.dumps({"tokens": {"a": legacy}}, indent=2) + ending)
+
+    db = TokenDB(db_path)
+    db.set_token("b", StoredToken("b", "u", [], time.time() + 3600, "c"))
+
+    db2 = TokenDB(db_path)
+    assert db2.get_token("a") is not None
+    assert db2.get_token("b") is not None
+
+
+def test_clients_validated_on_first_use(temp_dir):
+    import json
+
+    db_path = temp_dir / ".token_db.json"
+    good = {"client_id": "good", "redirect_uris": ["http://localhost/cb"]}
+    db_path.write_text(
+        json.dumps({"clients": {"good": good, "bad": {"redirect_uris": 5}}}) + "\n"
+    )
+
+    db = TokenDB(db_path)
+    assert isinstance(db._clients["good"], dict)
+    client = db.get_client("good")
+    assert isinstance(client, PermissiveClient)
+    assert db.get_client("good") is client
+    assert db.get_client("bad") is None
@@ -0,0 +1,61 @@
+"""Tests for torrent file handling."""
+
+import pytest
+
+from local_mcp.lib import torrent
+
+
+# _bdecode tests
+
+@pytest.mark.parametrize("data,expected", [
+    (b"i42e", 42),
+    (b"i-3e", -3),
+    (b"4:spam", b"spam"),
+    (b"0:", b""),
+    (b"l4:spami1ee", [b"spam", 1]),
+    (b"d3:bar4:spam3:fooi42ee", {"bar": b"spam", "foo": 42}),
+    (b"d4:infod5:filesld6:lengthi7e4:pathl1:a5:b.mkveeeee",
+     {"info": {"files": [{"length": 7, "path": [b"a", b"b.mkv"]}]}}),
+])
+def test_bdecode(data, expected):
+    assert torrent._bdecode(data) == (expected, len(data))
+
+
+def test_bdecode_rejects_garbage():
+    with pytest.raises(ValueError, match="Invalid bencode at 0: 'x'"):
+        torrent._bdecode(b"x")
+
+
+def test_bdecode_skips_unwanted_keys():
+    data = b"d8:announce3:url4:infod4:name5:a.mkv6:pieces4:\x00\x01\x02\x036:lengthi5eee"
+    assert torrent._bdecode(data, keys=frozenset({"info", "name"})) == (
+        {"info": {"name": b"a.mkv"}},
+        len(data),
+    )
+
+
+# video_filename tests
+
+@pytest.mark.parametrize("data,expected", [
+    # Single file
+    (b"d8:announce3:url4:infod6:lengthi9e4:name5:a.mkv6:pieces3:xyzee", "a.mkv"),
+    # Multi-file: the largest video wins
+    (
+        b"d4:infod5:filesl"
+        b"d6:lengthi900e4:pathl8:info.nfoee"
+        b"d6:lengthi50e6:md5sum1:x4:pathl1:S5:a.mkvee"
+        b"d6:lengthi70e4:pathl1:S5:b.mkvee"
+        b"e4:name1:S6:pieces3:xyzee",
+        "b.mkv",
+    ),
+])
+def test_video_filename(temp_dir, data, expected):
+    path = temp_dir / "t.torrent"
+    path.write_bytes(data)
+    assert torrent.video_filename(path) == expected
+
+
+def test_video_filename_of_corrupt_torrent_is_none(temp_dir):
+    path = temp_dir / "t.torrent"
+    path.write_bytes(b"d4:info")
+    assert torrent.video_filename(path) is None
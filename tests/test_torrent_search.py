@@ -1,5 +1,6 @@
 """Tests for nyaa search."""
 
+import httpx
 import pytest
 
 from local_mcp.lib import torrent
@@ -16,6 +17,15 @@ NYAA_ROW_HTML = """
 """
 
 
+@pytest.fixture(params=["html.parser", "lxml"])
+def html_parser(request, monkeypatch):
+    """Run a test with each tree builder _parse_page may use."""
+    if request.param == "lxml":
+        pytest.importorskip("lxml")
+    monkeypatch.setattr(torrent, "HTML_PARSER", request.param)
+    return request.param
+
+
 @pytest.mark.asyncio
 async def test_search_releases_builds_query_and_parses(monkeypatch):
     captured = {}
@@ -48,3 +58,139 @@ async def test_search_releases_builds_query_and_parses(monkeypatch):
     assert results[0]["title"] == "Tenmaku no Jaadugar"
     assert results[0]["episode"] == 3.0
     assert results[0]["torrent"] == "https://nyaa.si/download/1.torrent"
+
+
+@pytest.mark.asyncio
+async def test_fetch_group_releases_uses_given_client(monkeypatch):
+    urls = []
+
+    class FakeResponse:
+        text = NYAA_ROW_HTML
+
+        def raise_for_status(self):
+            pass
+
+    class SharedClient:
+        async def get(self, url, timeout=None):
+            urls.append(url)
+            return FakeResponse()
+
+    def no_new_client(**kwargs):
+        raise AssertionError("opened a new client")
+
+    monkeypatch.setattr(torrent.httpx, "AsyncClient", no_new_client)
+    results = await torrent.fetch_group_releases("SubsPlease", pages=2, client=SharedClient())
+    assert len(urls) == 2 and urls[1].endswith("&p=2")
+    assert [r["episode"] for r in results] == [3.0, 3.0]
+
+
+@pytest.mark.asyncio
+async def test_download_async_streams_into_watch_dir(monkeypatch, temp_dir):
+    body = b"d4:infod4:name8:ep.mkvee" * 10_000
+
+    def handler(request):
+        if request.url.path == "/download/1.torrent":
+            return httpx.Response(302, headers={"Location": "/files/1.torrent"})
+        return httpx.Response(200, content=body)
+
+    monkeypatch.setattr(torrent, "WATCH_DIR", temp_dir / "watch")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        dest = await torrent.download_async("https://nyaa.si/download/1.torrent", client=client)
+    assert dest == temp_dir / "watch" / "1.torrent"
+    assert dest.read_bytes() == body
+
+
+@pytest.mark.asyncio
+async def test_download_async_leaves_nothing_behind_on_failure(monkeypatch, temp_dir):
+    watch = temp_dir / "watch"
+
+    async def body():
+        yield b"d4:infod"
+        # nothing the torrent client watches for exists mid-download
+        assert not list(watch.glob("*.torrent"))
+        raise httpx.ReadError("connection reset")
+
+    def handler(request):
+        return httpx.Response(200, content=body())
+
+    monkeypatch.setattr(torrent, "WATCH_DIR", watch)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(httpx.ReadError):
+            await torrent.download_async("https://nyaa.si/download/1.torrent", client=client)
+    assert list(watch.iterdir()) == []
+
+
+def test_parse_page_skips_rows_without_release_titles(html_parser):
+    other = NYAA_ROW_HTML.replace("/view/1", "/view/2").replace(
+        "[SubsPlease] Tenmaku no Jaadugar - 03 (1080p) [AAAA].mkv",
+        "Some batch &amp; extras",
+    )
+    escaped = NYAA_ROW_HTML.replace("Tenmaku no Jaadugar", "Tom &amp; Jerry")
+    default_row = NYAA_ROW_HTML.replace('class="success"', 'class="default"')
+    html = other + NYAA_ROW_HTML + escaped + default_row
+
+    results = list(torrent._parse_page(html))
+    assert [r["title"] for r in results] == ["Tenmaku no Jaadugar", "Tom & Jerry"]
+    assert results[0]["magnet"] == "magnet:?xt=urn:btih:abc"
+
+
+@pytest.mark.parametrize("query,page,expected", [
+    ("SubsPlease", 1, "https://nyaa.si/?f=2&c=1_2&q=SubsPlease"),
+    ("SubsPlease", 2, "https://nyaa.si/?f=2&c=1_2&q=SubsPlease&p=2"),
+    # Group names and titles are quoted
+    ("[ASW] Frieren & co", 1, "https://nyaa.si/?f=2&c=1_2&q=%5BASW%5D+Frieren+%26+co"),
+])
+def test_search_url(query, page, expected):
+    assert torrent._search_url(query, page) == expected
+
+
+@pytest.mark.parametrize("tr", [
+    '<tr class="success odd">',
+    "<tr class='success'>",
+    "<tr class=success>",
+    '<tr data-id="1" class="odd success">',
+])
+def test_parse_page_keeps_rows_however_class_is_written(tr, html_parser):
+    html = NYAA_ROW_HTML.replace('<tr class="success">', tr)
+    assert [r["episode"] for r in torrent._parse_page(html)] == [3.0]
+
+
+def test_parse_page_reads_single_quoted_titles(html_parser):
+    html = NYAA_ROW_HTML.replace(
+        'title="[SubsPlease] Tenmaku no Jaadugar - 03 (1080p) [AAAA].mkv"',
+        "title='[SubsPlease] Tenmaku no Jaadugar - 03 (1080p) [AAAA].mkv'",
+    )
+    assert [r["title"] for r in torrent._parse_page(html)] == ["Tenmaku no Jaadugar"]
+
+
+@pytest.mark.parametrize("tr", [
+    '<tr class="default">',
+    '<tr class="not-success">',
+    '<tr class="successful">',
+])
+def test_parse_page_drops_rows_without_success_class(tr, html_parser):
+    html = NYAA_ROW_HTML.replace('<tr class="success">', tr)
+    assert list(torrent._parse_page(html)) == []
+
+
+def test_parse_page_reads_rows_with_omitted_end_tags(html_parser):
+    second = NYAA_ROW_HTML.replace("/view/1", "/view/2").replace(" - 03 ", " - 04 ")
+    html = NYAA_ROW_HTML.replace("</tr>", "") + second
+    assert [r["episode"] for r in torrent._parse_page(html)] == [3.0, 4.0]
+
+
+def test_parse_page_ignores_title_attributes_of_nested_tags(html_parser):
+    # A nested title that looks like a release must not stand in for the
+    # link's own, and a plain nested title must not hide it
+    nested = NYAA_ROW_HTML.replace(
+        '<td>1.4 GiB</td>',
+        '<td><span title="[SubsPlease] Other Show - 09 (1080p) [BBBB].mkv">1.4 GiB</span></td>',
+    )
+    assert [(r["title"], r["episode"]) for r in torrent._parse_page(nested)] == [
+        ("Tenmaku no Jaadugar", 3.0)
+    ]
+    batch = NYAA_ROW_HTML.replace(
+        'title="[SubsPlease] Tenmaku no Jaadugar - 03 (1080p) [AAAA].mkv"',
+        'title="Batch"',
+    ).replace('<td>cat</td>', '<td><a title="[SubsPlease] Other Show - 09 (1080p) [BBBB].mkv">cat</a></td>')
+    assert list(torrent._parse_page(batch)) == []